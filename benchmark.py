@@ -0,0 +1,311 @@
+"""
+benchmark.py
+Scale benchmarks for water_portal.py.
+
+Generates seeded, realistic customer / meter-read / import files and times the
+portal's operations headlessly (no input()), recording wall time and peak
+traced memory per operation and dataset size.
+
+Usage:
+    python benchmark.py                          # sizes 1k,100k -> benchmark_results.json
+    python benchmark.py --sizes 1k,100k,1m,5m --out nightly.json
+    python benchmark.py --compare baseline.json  # run, then flag regressions vs baseline
+    python benchmark.py compare old.json new.json [--threshold 0.2]
+
+Every run works in its own scratch directory (--workdir, default a temp dir),
+so the portal's data, audit and history files in the current directory are
+never touched.
+"""
+
+import sys
+import os
+import time
+import json
+import shutil
+import platform
+import tempfile
+import argparse
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import numpy as np
+
+import water_portal as wp
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000, "5m": 5_000_000}
+DEFAULT_SIZES = "1k,100k"
+DEFAULT_OUT = "benchmark_results.json"
+READ_FRACTION = 0.5       # share of customers in the meter-read file
+IMPORT_FRACTION = 0.1     # new customers in the import file, relative to size
+AUDIT_ROWS = 10_000       # append_audit calls timed per size
+SEARCH_QUERIES = ["kumar", "ravi", "sha", "90000", "priya s", "nomatchxyz"]
+REGRESSION_THRESHOLD = 0.20   # compare: flag ops slower by more than this fraction
+NOISE_SECONDS = 0.005         # compare: ignore differences below this
+
+# -------------------------
+# Synthetic data
+# -------------------------
+FIRST_NAMES = ["Ravi", "Sneha", "Amit", "Meera", "Karan", "Priya", "Vikram", "Anita", "Suresh",
+               "Lakshmi", "Arjun", "Divya", "Rahul", "Kavya", "Manoj", "Pooja", "Sanjay", "Nisha"]
+LAST_NAMES = ["Kumar", "Patel", "Singh", "Rao", "Iyer", "Sharma", "Reddy", "Nair", "Gupta",
+              "Menon", "Das", "Joshi", "Pillai", "Verma", "Shah", "Bose"]
+CITIES = ["Chennai", "Bangalore", "Hyderabad", "Vellore", "Madurai", "Coimbatore", "Mysore",
+          "Salem", "Tiruchy", "Erode", "Tirunelveli", "Hosur"]
+TARIFFS = [1.5, 2.0, 2.5, 3.0, 4.0]
+
+def _names(rng: np.random.Generator, n: int) -> np.ndarray:
+    first = np.asarray(FIRST_NAMES, dtype=object)[rng.integers(len(FIRST_NAMES), size=n)]
+    last = np.asarray(LAST_NAMES, dtype=object)[rng.integers(len(LAST_NAMES), size=n)]
+    return first + " " + last
+
+def _phones(rng: np.random.Generator, n: int) -> np.ndarray:
+    # unique 10-digit mobile numbers
+    nums = 9_000_000_000 + rng.choice(999_999_999, size=n, replace=False)
+    return nums.astype(str)
+
+def generate_customers(n: int, seed: int = 0) -> pd.DataFrame:
+    """COLUMNS-shaped customer frame: skewed city sizes, gamma-distributed usage."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(CITIES) + 1)   # a few big cities, a long tail
+    cities = np.asarray(CITIES, dtype=object)[rng.choice(len(CITIES), size=n, p=weights / weights.sum())]
+    last = np.round(rng.uniform(0, 5000, n), 1)
+    df = wp.new_customer_frame(1, _names(rng, n), cities, _phones(rng, n), last,
+                               rng.choice(TARIFFS, size=n))
+    use = np.round(rng.gamma(2.0, 25.0, n), 1)
+    df["current_reading"] = last + use
+    df["consumption"] = use
+    df["paid"] = rng.random(n) < 0.7
+    df["plan_id"] = np.where(rng.random(n) < 0.2, "slab", "")
+    return df
+
+def generate_readings(customers: pd.DataFrame, seed: int = 0, fraction: float = READ_FRACTION) -> pd.DataFrame:
+    """customer_id,current_reading rows for a share of customers, with ~0.1% bad rows."""
+    rng = np.random.default_rng(seed + 1)
+    n = len(customers)
+    pick = rng.choice(n, size=max(int(n * fraction), 1), replace=False)
+    reads = customers["current_reading"].to_numpy()[pick] + np.round(rng.gamma(2.0, 25.0, len(pick)), 1)
+    out = pd.DataFrame({"customer_id": customers["customer_id"].to_numpy()[pick].astype(str),
+                        "current_reading": reads.astype(str)})
+    bad = rng.random(len(out)) < 0.001
+    out.loc[bad, "current_reading"] = "n/a"
+    unknown = rng.random(len(out)) < 0.001
+    out.loc[unknown, "customer_id"] = str(n + 10_000_000)
+    return out
+
+def generate_import(n: int, seed: int = 0) -> pd.DataFrame:
+    """name,address,phone,last_reading,tariff rows as accepted by import_customers_from_csv."""
+    rng = np.random.default_rng(seed + 2)
+    return pd.DataFrame({
+        "name": _names(rng, n),
+        "address": np.asarray(CITIES, dtype=object)[rng.integers(len(CITIES), size=n)],
+        "phone": _phones(rng, n),
+        "last_reading": np.round(rng.uniform(0, 5000, n), 1),
+        "tariff": rng.choice(TARIFFS, size=n),
+    })
+
+# -------------------------
+# Measurement
+# -------------------------
+
+def _fresh_session() -> None:
+    """
+    Forget any loaded data so the next operation starts cold. The reading
+    history starts empty too: bulk_readings would otherwise find the
+    partitions grown by the previous repeat and time a different path.
+    """
+    shutil.rmtree(wp.HISTORY_DIR, ignore_errors=True)
+    wp.READINGS = wp.ReadingHistory()
+    wp._STORE = wp.DataStore(policy=wp.FLUSH_ON_EXIT, journal=False)
+    wp._PLANS = None
+    wp.SEARCH_INDEX.built = False
+    wp.CONSUMPTION_STATS.built = False
+    wp.UNPAID.built = False
+
+def _ok(result: Any, op: str) -> Any:
+    """The portal's file helpers print their errors and return None/False/[]; a benchmark must fail instead."""
+    if result is None or result is False or (isinstance(result, list) and not result):
+        raise RuntimeError(f"{op} failed")
+    return result
+
+def timed(fn: Callable[[], Any]) -> float:
+    """Wall time of one call."""
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def peak_memory(fn: Callable[[], Any]) -> float:
+    """
+    Peak traced allocation (MB) of one call. Measured in a separate run:
+    tracemalloc slows Python-heavy operations several-fold.
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+def _quiet(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Run fn with the portal's [INFO]/[WARN] prints silenced."""
+    def run():
+        saved = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            return fn()
+        finally:
+            sys.stdout.close()
+            sys.stdout = saved
+    return run
+
+def bench_size(label: str, n: int, seed: int, workdir: str, repeat: int,
+               trace_memory: bool) -> List[Dict[str, Any]]:
+    """Generate the fixtures for one size in workdir and time every operation."""
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        customers = generate_customers(n, seed)
+        wp.atomic_write(customers, wp.data_path())
+        generate_readings(customers, seed).to_csv("reads.csv", index=False)
+        generate_import(max(int(n * IMPORT_FRACTION), 1), seed).to_csv("import.csv", index=False)
+        del customers
+
+        def setup_loaded():
+            _fresh_session()
+            wp.get_store().df
+
+        def search_all():
+            for q in SEARCH_QUERIES:
+                wp.find_customers(q, limit=wp.SEARCH_RESULT_LIMIT)
+
+        def audit_rows():
+            for i in range(AUDIT_ROWS):
+                wp.append_audit("bench", f"row={i}")
+            wp.AUDIT.flush()
+
+        # (name, setup, operation); setup is not timed
+        ops = [
+            ("load_data", _fresh_session, wp.load_data),
+            ("save_data", setup_loaded, lambda: wp.save_data(wp.get_store().df)),
+            ("bill_amounts", setup_loaded, lambda: wp.bill_amounts(wp.get_store().df)),
+            ("summary_stats", setup_loaded, lambda: wp.consumption_stats(exact=True)),
+            ("search_first", setup_loaded, search_all),      # includes building the index
+            ("search_warm", lambda: (setup_loaded(), search_all()), search_all),
+            ("append_audit", lambda: None, audit_rows),
+            ("bulk_readings", setup_loaded,
+             lambda: _ok(wp.bulk_update_consumption_from_csv("reads.csv"), "bulk_readings")),
+            ("import_customers", setup_loaded,
+             lambda: _ok(wp.import_customers_from_csv("import.csv"), "import_customers")),
+            ("export_bills", setup_loaded, lambda: _ok(wp.export_bills("bills.csv"), "export_bills")),
+        ]
+        results = []
+        for name, setup, op in ops:
+            runs = []
+            for _ in range(repeat):
+                _quiet(setup)()
+                runs.append(timed(_quiet(op)))
+            peak = None
+            if trace_memory:
+                _quiet(setup)()
+                peak = peak_memory(_quiet(op))
+            results.append({"size": label, "rows": n, "op": name, "seconds": min(runs), "peak_mb": peak})
+            mem = "" if peak is None else f"  {peak:9.1f} MB"
+            wp.cli_info(f"{label:>5} {name:<17} {min(runs):9.4f} s{mem}")
+        return results
+    finally:
+        wp.flush_all()      # buffered audit/journal rows belong to workdir
+        os.chdir(cwd)
+        wp._STORE = None
+
+def run(sizes: List[str], seed: int, out: str, workdir: Optional[str], repeat: int,
+        trace_memory: bool) -> Dict[str, Any]:
+    root = workdir or tempfile.mkdtemp(prefix="water_bench_")
+    results = []
+    try:
+        for label in sizes:
+            results.extend(bench_size(label, SIZES[label], seed, os.path.join(root, label), repeat, trace_memory))
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "storage_format": wp.STORAGE_FORMAT,
+            "seed": seed,
+            "repeat": repeat,
+            "trace_memory": trace_memory,
+        },
+        "results": results,
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    wp.cli_info(f"Results written to {out}")
+    return report
+
+# -------------------------
+# Comparison
+# -------------------------
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float = REGRESSION_THRESHOLD) -> int:
+    """
+    Print old vs new seconds per (size, op) and flag ops that got slower by
+    more than threshold (and NOISE_SECONDS). Returns the number flagged.
+    """
+    key = ["size", "op"]
+    a = pd.DataFrame(old["results"]).set_index(key)
+    b = pd.DataFrame(new["results"]).set_index(key)
+    both = a[["seconds", "peak_mb"]].join(b[["seconds", "peak_mb"]], how="inner", lsuffix="_old", rsuffix="_new")
+    if both.empty:
+        wp.cli_warn("No common (size, op) pairs to compare.")
+        return 0
+    both["ratio"] = both["seconds_new"] / both["seconds_old"]
+    both["regression"] = ((both["ratio"] > 1 + threshold)
+                          & (both["seconds_new"] - both["seconds_old"] > NOISE_SECONDS))
+    print(both.round(4).to_string())
+    flagged = int(both["regression"].sum())
+    if flagged:
+        wp.cli_warn(f"{flagged} operations regressed by more than {threshold:.0%}.")
+    else:
+        wp.cli_info("No regressions.")
+    return flagged
+
+def _load_report(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "compare":
+        p = argparse.ArgumentParser(prog="benchmark.py compare")
+        p.add_argument("old")
+        p.add_argument("new")
+        p.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+        args = p.parse_args(argv[1:])
+        return 1 if compare(_load_report(args.old), _load_report(args.new), args.threshold) else 0
+
+    p = argparse.ArgumentParser(prog="benchmark.py", description="Scale benchmarks for water_portal.py")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma-separated from {', '.join(SIZES)}")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=1, help="runs per operation; the fastest is kept")
+    p.add_argument("--out", default=DEFAULT_OUT)
+    p.add_argument("--workdir", help="keep generated files here instead of a temp dir")
+    p.add_argument("--no-memory", action="store_true", help="skip the extra tracemalloc run per operation")
+    p.add_argument("--compare", metavar="BASELINE", help="compare the new results with this file")
+    p.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = p.parse_args(argv)
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        p.error(f"unknown size(s): {', '.join(unknown)}")
+    report = run(sizes, args.seed, args.out, args.workdir, max(args.repeat, 1), not args.no_memory)
+    if args.compare:
+        return 1 if compare(_load_report(args.compare), report, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,11 +7,32 @@ Part 4 - Client Interface & Main Menu      : Darshan
 """
 
 # -------------------------
-# IMPORTS (allowed only)
+# IMPORTS (standard library, pandas and numpy; pyarrow optional)
 # -------------------------
 import sys
+import os
+import time
+import atexit
 import csv
-from typing import Any, Dict, List, Optional
+import itertools
+import json
+import zlib
+import argparse
+import shlex
+import threading
+import functools
+import cProfile
+import pstats
+from collections import deque
+try:
+    import fcntl       # advisory file locks (POSIX)
+except ImportError:    # Windows
+    fcntl = None
+    import msvcrt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
 import numpy as np
@@ -21,37 +42,311 @@ import numpy as np
 # -------------------------
 DATA_FILE = "water_data.csv"
 BILLS_FILE = "bills_export.csv"
-BACKUP_FILE = "backup.csv"
+EXPORT_CHUNK_ROWS = 50_000    # customers billed and written per step by export_bills
+EXPORT_WORKERS = int(os.environ.get("WATER_EXPORT_WORKERS", "0"))  # CSV formatting processes; 0 = in-process
+EXPORT_SHARDS = int(os.environ.get("WATER_EXPORT_SHARDS", "1"))    # split bills into this many files
+BACKUP_DIR = "backups"        # numbered backup generations + manifest.json
+BACKUP_KEEP = 10              # generations always kept (older chains are pruned)
+BACKUP_FULL_EVERY = 20        # deltas after a full baseline before the next full one
 AUDIT_FILE = "audit_log.csv"
+AUDIT_COLUMNS = ["timestamp", "action", "detail"]
+AUDIT_BATCH_SIZE = 50                 # buffered audit rows written per append
+AUDIT_MAX_BYTES = 5 * 1024 * 1024     # rotate audit_log.csv to a segment past this size
 SUMMARY_FILE = "summary_report.csv"
+PAYMENT_EXCEPTIONS_FILE = "payment_exceptions.csv"  # payments that did not settle a bill exactly
+PLANS_FILE = "tariff_plans.json"   # tariff plan table and the default plan
+HISTORY_DIR = "history"            # meter readings, one append-only CSV per period (YYYY-MM)
+# On-disk format of DATA_FILE and backups: "csv" (default), "npz", "parquet", "feather".
+# The file extension follows the format (water_data.npz, ...); CSV stays the
+# import/export format either way.
+STORAGE_FORMAT = os.environ.get("WATER_STORAGE_FORMAT", "csv")
+SHARD_DIR = "water_data.shards"   # optional customer_id-range shards + manifest.json (see ShardSet)
+SHARD_WORKERS = int(os.environ.get("WATER_SHARD_WORKERS", "0"))  # shard read/write processes; 0 = one per shard up to the CPU count
+SHARD_PARALLEL_ROWS = 50_000      # smaller tables are read/written in-process
+JOURNAL_FILE = "water_data.journal"   # write-ahead log of point edits since the last full save
+JOURNAL_MAX_ADD_ROWS = 1000           # larger adds are saved in full instead of journaled
+LOCK_FILE = "water_data.lock"         # held only while a session commits; holds the commit sequence number
+LOCK_RETRIES = 5                      # attempts at a blocking lock before giving up (EINTR, ENOLCK, ...)
+JOURNAL_MAX_SLOTS = 64                # concurrent sessions; claim() gives up past this many locked slots
 ADMIN_PASS = "admin123"
 COLUMNS = [
     "customer_id", "name", "address", "phone",
     "last_month_reading", "current_reading",
     "consumption", "tariff_per_unit", "last_updated",
-    "paid", "paid_date"
+    "paid", "paid_date", "plan_id",
+    "arrears", "overdue_periods", "row_version"
 ]
+# Bookkeeping columns left out of listings and the bills export
+INTERNAL_COLUMNS = ["row_version"]
 # Overdue rule: unpaid AND consumption > 0
 # (No datetime allowed per instruction)
 OVERDUE_CRITERIA = "UNPAID_WITH_CONSUMPTION"
+# A bill still unpaid when the next period's reading arrives moves into
+# arrears (plus PENALTY_RATE on everything owed) and the account ages a period.
+PENALTY_RATE = 0.02
+AGING_BUCKETS = ["current", "30", "60", "90+"]   # overdue_periods 0, 1, 2, 3+
 
 PAGINATION_SIZE = 10  # rows per page when viewing tables
 
+# Opt-in instrumentation (see Metrics): WATER_METRICS=1 or --metrics records
+# per-operation timings; WATER_PROFILE=<operation> or --profile cProfiles it.
+# Both go before the command: python water_portal.py --metrics serve
+METRICS_ENABLED = os.environ.get("WATER_METRICS", "0") not in ("", "0")
+METRICS_FILE = os.environ.get("WATER_METRICS_FILE", "metrics.json")
+METRICS_WINDOW = 1024          # latest durations per operation behind p50/p99
+METRICS_WRITE_SECONDS = 5.0    # METRICS_FILE is rewritten at most this often
+PROFILE_OPERATION = os.environ.get("WATER_PROFILE") or None
+PROFILE_DIR = "profiles"
+PROFILE_TOP = 15               # functions printed after a profiled operation
+
+# -------------------------
+# Instrumentation
+# -------------------------
+# Operations are timed through @instrumented (whole functions) and
+# METRICS.span(name) (phases inside one). A span opened inside another is
+# recorded as "<outermost>/<name>", e.g. "export_bills/bill_amounts", so one
+# admin action breaks down into its data layer and billing phases. When both
+# metrics and profiling are off, a wrapped call costs one attribute check.
+
+class _Span:
+    __slots__ = ("metrics", "name", "key", "start", "rows", "bytes_read", "bytes_written", "profile")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+        self.rows = self.bytes_read = self.bytes_written = 0
+        self.profile = None
+
+    def __enter__(self):
+        stack = self.metrics._stack()
+        self.key = f"{stack[0].name}/{self.name}" if stack else self.name
+        stack.append(self)
+        if self.metrics.profile in (self.name, "*") and not any(s.profile for s in stack):
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        stack = self.metrics._stack()
+        stack.pop()
+        if self.metrics.enabled:
+            self.metrics.record(self.key, seconds, self.rows, self.bytes_read, self.bytes_written)
+            if not stack:
+                self.metrics.maybe_write()
+        if self.profile is not None:
+            self.metrics.dump_profile(self.name, self.profile)
+        return False
+
+class Metrics:
+    """
+    Rolling per-operation metrics: call count, total seconds, p50/p99/max of
+    the latest METRICS_WINDOW durations, and the rows and bytes the operation
+    reported through note(). Thread-safe (the HTTP API records from many
+    threads). Written to METRICS_FILE as JSON and served by GET /stats.
+    """
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.window = window
+        self.enabled = False
+        self.profile: Optional[str] = None
+        self.active = False      # enabled or profiling: spans are recorded
+        self.path = METRICS_FILE
+        self.ops: Dict[str, Dict[str, Any]] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._written = 0.0
+        self.started = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def configure(self, enabled: Optional[bool] = None, path: Optional[str] = None,
+                  profile: Optional[str] = None) -> None:
+        if enabled is not None:
+            self.enabled = enabled
+        if path:
+            self.path = path
+        if profile:
+            self.profile = profile
+        self.active = self.enabled or self.profile is not None
+
+    def _stack(self) -> List[_Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name: str):
+        """Context manager timing one operation or phase (a no-op when inactive)."""
+        return _Span(self, name) if self.active else _NO_SPAN
+
+    def note(self, rows: int = 0, bytes_read: int = 0, bytes_written: int = 0) -> None:
+        """Attribute rows/bytes to the innermost open span of this thread."""
+        if not self.active:
+            return
+        stack = self._stack()
+        if stack:
+            top = stack[-1]
+            top.rows += int(rows)
+            top.bytes_read += int(bytes_read)
+            top.bytes_written += int(bytes_written)
+
+    def record(self, op: str, seconds: float, rows: int = 0, bytes_read: int = 0,
+               bytes_written: int = 0) -> None:
+        with self._lock:
+            m = self.ops.get(op)
+            if m is None:
+                m = self.ops[op] = {"count": 0, "total_s": 0.0, "rows": 0, "bytes_read": 0,
+                                    "bytes_written": 0, "recent": deque(maxlen=self.window)}
+            m["count"] += 1
+            m["total_s"] += seconds
+            m["rows"] += rows
+            m["bytes_read"] += bytes_read
+            m["bytes_written"] += bytes_written
+            m["recent"].append(seconds)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        """Add n to a plain event counter (reported next to the timings)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ops = {op: (dict(m), np.array(m["recent"])) for op, m in self.ops.items()}
+            counters = dict(sorted(self.counters.items()))
+        out = {}
+        for op, (m, recent) in sorted(ops.items()):
+            p50, p99 = quantiles(recent, [0.5, 0.99])
+            out[op] = {
+                "count": m["count"],
+                "total_s": round(m["total_s"], 6),
+                "p50_ms": round(p50 * 1000, 3),
+                "p99_ms": round(p99 * 1000, 3),
+                "max_ms": round(float(recent.max()) * 1000, 3),
+                "rows": m["rows"],
+                "bytes_read": m["bytes_read"],
+                "bytes_written": m["bytes_written"],
+            }
+        return {"enabled": self.enabled, "started": self.started, "window": self.window,
+                "ops": out, "counters": counters}
+
+    def write(self, path: Optional[str] = None) -> None:
+        """Replace the metrics file with the current snapshot."""
+        if not self.enabled or not (self.ops or self.counters):
+            return
+        path = path or self.path
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(tmp, path)
+        self._written = time.monotonic()
+
+    def maybe_write(self) -> None:
+        if time.monotonic() - self._written >= METRICS_WRITE_SECONDS:
+            self.write()
+
+    def dump_profile(self, name: str, prof: cProfile.Profile) -> None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name.replace('/', '_')}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        prof.dump_stats(path)
+        print(f"\n---- profile of {name} (top {PROFILE_TOP} by cumulative time) ----")
+        pstats.Stats(prof, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        cli_info(f"Profile written to {path} (open with: python -m pstats {path})")
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+METRICS = Metrics()
+METRICS.configure(enabled=METRICS_ENABLED, profile=PROFILE_OPERATION)
+
+def instrumented(name: Optional[str] = None):
+    """Decorator: run the function inside METRICS.span(name or its __name__)."""
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if not METRICS.active:
+                return fn(*args, **kwargs)
+            with _Span(METRICS, label):
+                return fn(*args, **kwargs)
+        return call
+    return wrap
+
 # -------------------------
 # Utility functions used by many parts
 # -------------------------
 
+@instrumented()
 def _ensure_schema(df: pd.DataFrame) -> pd.DataFrame:
     """Ensure expected columns exist and types are normalized."""
     for col in COLUMNS:
         if col not in df.columns:
-            df[col] = "" if col in ("name", "address", "phone", "last_updated", "paid_date") else 0
+            df[col] = "" if col in ("name", "address", "phone", "last_updated", "paid_date", "plan_id") else 0
     # numeric normalization
-    for col in ("last_month_reading", "current_reading", "consumption", "tariff_per_unit"):
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
-    df["customer_id"] = pd.to_numeric(df["customer_id"], errors="coerce").fillna(0).astype(int)
-    # normalize paid column to boolean-like values (True/False or False)
-    df["paid"] = df["paid"].replace({None: False, "": False, "False": False, "False ": False}).astype(object)
+    for col in ("last_month_reading", "current_reading", "consumption", "tariff_per_unit", "arrears"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0).astype(float)
+    for col in ("customer_id", "overdue_periods", "row_version"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+    # normalize paid column to real booleans (True/"True" -> True, anything else False)
+    df["paid"] = _paid_as_bool(df["paid"])
+    return df
+
+def _paid_as_bool(col: pd.Series) -> pd.Series:
+    """Collapse the mixed True/False/'True'/'' paid values to real booleans."""
+    if col.dtype == bool:
+        return col
+    return col.astype(str).str.strip().str.lower().isin(("true", "1", "yes"))
+
+def _text_dtype() -> Optional[str]:
+    """Arrow-backed strings when pyarrow is installed, else pandas' default."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    return "string[pyarrow]"
+
+# Compact in-memory dtypes applied by load_data (see memory_report()).
+# tariff_per_unit is a categorical of the exact float64 rates rather than
+# float32, so bills are still computed from the same values.
+SCHEMA_DTYPES = {
+    "customer_id": "uint32",
+    "name": "text",
+    "address": "category",
+    "phone": "text",
+    "tariff_per_unit": "category",
+    "paid": "bool",
+    "plan_id": "category",
+    "overdue_periods": "uint16",
+    "row_version": "uint32",
+}
+
+@instrumented()
+def apply_compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a normalized customer frame to the SCHEMA_DTYPES layout."""
+    for col, dtype in SCHEMA_DTYPES.items():
+        if dtype == "text":
+            dtype = _text_dtype()
+            if dtype is None:
+                continue
+        elif dtype in ("uint32", "uint16"):
+            ids = df[col]
+            if len(ids) and (ids.min() < 0 or ids.max() > np.iinfo(dtype).max):
+                continue
+        elif dtype == "category" and df[col].dtype == object:
+            df[col] = df[col].fillna("")
+        df[col] = df[col].astype(dtype)
     return df
 
 def pretty_print_df(df: pd.DataFrame, limit: Optional[int] = None) -> None:
@@ -59,13 +354,10 @@ def pretty_print_df(df: pd.DataFrame, limit: Optional[int] = None) -> None:
     if df.empty:
         print("[INFO] No records to display.")
         return
-    disp = df.copy()
+    disp = (df.head(limit) if limit else df).drop(columns=INTERNAL_COLUMNS, errors="ignore")
     if "bill_amount" in disp.columns:
-        disp["bill_amount"] = disp["bill_amount"].apply(lambda v: f"{v:.2f}")
-    if limit:
-        print(disp.head(limit).to_string(index=False))
-    else:
-        print(disp.to_string(index=False))
+        disp["bill_amount"] = disp["bill_amount"].map("{:.2f}".format)
+    print(disp.to_string(index=False))
 
 def paginate_df(df: pd.DataFrame, page_size: int = PAGINATION_SIZE) -> None:
     """Show DataFrame pages interactively on CLI."""
@@ -109,6 +401,18 @@ def read_float(prompt: str, default: Optional[float] = None) -> float:
         except Exception:
             print("Please enter a valid number (e.g., 123.45).")
 
+def read_period(prompt: str = "Billing period YYYY-MM") -> str:
+    """A billing period typed as YYYY-MM; blank = the current month."""
+    default = current_period()
+    while True:
+        s = input(f"{prompt} [{default}]: ").strip()
+        if s == "":
+            return default
+        year, _, month = s.partition("-")
+        if len(year) == 4 and year.isdigit() and len(month) == 2 and month.isdigit() and 1 <= int(month) <= 12:
+            return s
+        print("Please enter a period like 2025-11.")
+
 def confirm(prompt: str = "Are you sure? (y/n): ") -> bool:
     ans = input(prompt).strip().lower()
     return ans in ("y", "yes")
@@ -122,90 +426,1455 @@ def cli_warn(msg: str) -> None:
 def cli_error(msg: str) -> None:
     print(f"[ERROR] {msg}")
 
+class AuditWriter:
+    """
+    Append-only audit log. Rows are buffered and appended to AUDIT_FILE in
+    batches (never re-read or rewritten). When the file grows past max_bytes
+    it is renamed to the next numbered segment (audit_log.1.csv, ...) and a
+    fresh AUDIT_FILE with the same header is started. Flushes hold a lock
+    file next to the log, so sessions sharing it never rotate twice or
+    interleave a header.
+    """
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = AUDIT_BATCH_SIZE,
+                 max_bytes: int = AUDIT_MAX_BYTES):
+        self._path = path
+        self.batch_size = max(int(batch_size), 1)
+        self.max_bytes = max_bytes
+        self.buffer: List[List[str]] = []
+
+    @property
+    def path(self) -> str:
+        return self._path or AUDIT_FILE
+
+    @property
+    def lock_path(self) -> str:
+        return os.path.splitext(self.path)[0] + ".lock"
+
+    def write(self, action: str, detail: str) -> None:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.buffer.append([ts, action, detail])
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Append all buffered rows to the active audit file."""
+        if not self.buffer:
+            return
+        with METRICS.span("audit_flush"), _open_lock(self.lock_path) as lock:
+            _acquire(lock, self.lock_path)
+            try:
+                self._rotate_if_needed()
+                new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                with open(self.path, "a", newline="", encoding="utf-8") as f:
+                    w = csv.writer(f)
+                    if new_file:
+                        w.writerow(AUDIT_COLUMNS)
+                    start = f.tell()
+                    w.writerows(self.buffer)
+                    METRICS.note(rows=len(self.buffer), bytes_written=f.tell() - start)
+            finally:
+                _unlock_file(lock)
+            self.buffer.clear()
+
+    def segments(self) -> List[str]:
+        """Rotated segment paths, oldest first (the active file is not included)."""
+        root, ext = os.path.splitext(self.path)
+        out = []
+        n = 1
+        while os.path.exists(f"{root}.{n}{ext}"):
+            out.append(f"{root}.{n}{ext}")
+            n += 1
+        return out
+
+    def _rotate_if_needed(self) -> None:
+        # called with lock_path held: the size is checked by the session that rotates
+        if not self.max_bytes or not os.path.exists(self.path):
+            return
+        if os.path.getsize(self.path) < self.max_bytes:
+            return
+        root, ext = os.path.splitext(self.path)
+        os.replace(self.path, f"{root}.{len(self.segments()) + 1}{ext}")
+
+AUDIT = AuditWriter()
+
 def append_audit(action: str, detail: str) -> None:
-    """Append a simple audit row to AUDIT_FILE using pandas append semantics."""
-    try:
-        df_a = pd.read_csv(AUDIT_FILE, dtype=str)
-    except Exception:
-        df_a = pd.DataFrame(columns=["timestamp", "action", "detail"])
-    import time
-    ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    new = {"timestamp": ts, "action": action, "detail": detail}
-    df_a = pd.concat([df_a, pd.DataFrame([new])], ignore_index=True)
-    df_a.to_csv(AUDIT_FILE, index=False)
+    """Queue an audit row; AUDIT appends it to AUDIT_FILE on its next flush."""
+    AUDIT.write(action, detail)
 
 # =====================================================
 # PART 1: DATA MANAGEMENT & INITIALIZATION
 # Rithwik
 # =====================================================
 
+# -------------------------
+# Storage backends
+# -------------------------
+STRING_COLUMNS = ("name", "address", "phone", "last_updated", "paid_date", "plan_id")
+
+def _typed_for_binary(df: pd.DataFrame) -> pd.DataFrame:
+    """Frame with plain str/number/bool columns that columnar formats can store."""
+    out = _ensure_schema(df.reset_index(drop=True))[COLUMNS]
+    for col in STRING_COLUMNS:
+        out[col] = out[col].astype(object).fillna("").astype(str)
+    return out
+
+class CsvBackend:
+    """Text CSV; every value is parsed back from strings by _ensure_schema."""
+    name = "csv"
+    suffix = ".csv"
+
+    def read(self, path: str) -> pd.DataFrame:
+        return pd.read_csv(path, dtype=str)
+
+    def write(self, df: pd.DataFrame, path: str) -> None:
+        df.to_csv(path, index=False)
+
+class NpzBackend:
+    """One typed NumPy array per column in an uncompressed .npz (numpy only)."""
+    name = "npz"
+    suffix = ".npz"
+
+    def read(self, path: str) -> pd.DataFrame:
+        with np.load(path, allow_pickle=False) as z:
+            return pd.DataFrame({col: z[col] for col in z.files})
+
+    def write(self, df: pd.DataFrame, path: str) -> None:
+        out = _typed_for_binary(df)
+        arrays = {col: out[col].to_numpy(dtype=str if col in STRING_COLUMNS else None) for col in COLUMNS}
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+class ParquetBackend:
+    """Apache Parquet via pandas; needs pyarrow."""
+    name = "parquet"
+    suffix = ".parquet"
+
+    def read(self, path: str) -> pd.DataFrame:
+        return pd.read_parquet(path)
+
+    def write(self, df: pd.DataFrame, path: str) -> None:
+        _typed_for_binary(df).to_parquet(path, index=False)
+
+class FeatherBackend(ParquetBackend):
+    """Arrow IPC (Feather v2) via pandas; needs pyarrow."""
+    name = "feather"
+    suffix = ".feather"
+
+    def read(self, path: str) -> pd.DataFrame:
+        return pd.read_feather(path)
+
+    def write(self, df: pd.DataFrame, path: str) -> None:
+        _typed_for_binary(df).to_feather(path)
+
+STORAGE_BACKENDS = {b.name: b for b in (CsvBackend(), NpzBackend(), ParquetBackend(), FeatherBackend())}
+
+def get_backend(fmt: Optional[str] = None):
+    fmt = (fmt or STORAGE_FORMAT).lower()
+    if fmt not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage format '{fmt}' (choose from {', '.join(STORAGE_BACKENDS)})")
+    if fmt in ("parquet", "feather"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"Storage format '{fmt}' needs the pyarrow package")
+    return STORAGE_BACKENDS[fmt]
+
+def _with_suffix(path: str, fmt: Optional[str] = None) -> str:
+    return os.path.splitext(path)[0] + get_backend(fmt).suffix
+
+def data_path(fmt: Optional[str] = None) -> str:
+    """DATA_FILE with the extension of the given (or configured) format."""
+    return _with_suffix(DATA_FILE, fmt)
+
+# -------------------------
+# Sharded storage
+# -------------------------
+# python water_portal.py shard N   splits the customers over N files in
+# SHARD_DIR, each holding one customer_id range (equal row counts at split
+# time; new IDs land in the last, open-ended range). manifest.json lists the
+# ranges, files and format, and its presence switches the portal to this
+# layout. Shards are read and written one per worker process, a flush
+# rewrites only the shards holding changed IDs, and the shards concatenated
+# in range order give back the single-file table (rows in customer_id order).
+# python water_portal.py shard 1   merges them into one data file again.
+
+def _read_shard(args) -> pd.DataFrame:
+    """One shard, schema-normalized (runs in pool workers, so module-level)."""
+    path, fmt = args
+    return read_data_file(path, fmt)
+
+def _write_shard(args) -> int:
+    """Atomically rewrite one shard and return its size (pool worker)."""
+    df, path, fmt = args
+    atomic_write(df, path, fmt)
+    return os.path.getsize(path)
+
+class ShardSet:
+    """The sharded layout in SHARD_DIR: manifest.json plus one file per customer_id range."""
+
+    def __init__(self, root: Optional[str] = None):
+        self._root = root
+
+    @property
+    def root(self) -> str:
+        return self._root or SHARD_DIR
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, "manifest.json")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def manifest(self) -> Dict[str, Any]:
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+        _fsync_dir(self.manifest_path)
+
+    @staticmethod
+    def shard_of(bounds: List[int], cids: np.ndarray) -> np.ndarray:
+        """Shard number of each customer ID (bounds[i] is the lowest ID of shard i)."""
+        return np.maximum(np.searchsorted(np.asarray(bounds), cids, side="right") - 1, 0)
+
+    @staticmethod
+    def workers(shards: int, rows: int) -> int:
+        """Processes for a job over shards holding rows customers (0 = in-process)."""
+        if shards < 2 or rows < SHARD_PARALLEL_ROWS:
+            return 0
+        n = min(SHARD_WORKERS or os.cpu_count() or 1, shards)
+        return n if n > 1 else 0
+
+    def _map(self, fn, jobs: List[Any], rows: int) -> List[Any]:
+        workers = self.workers(len(jobs), rows)
+        if not workers:
+            return [fn(job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, jobs))
+
+    def load(self) -> pd.DataFrame:
+        """All shards read in parallel and concatenated in range order."""
+        m = self.manifest()
+        paths = [os.path.join(self.root, name) for name in m["files"]]
+        with METRICS.span("read_shards"):
+            frames = self._map(_read_shard, [(p, m["format"]) for p in paths], sum(m["rows"]))
+            if METRICS.active:
+                METRICS.note(rows=sum(len(f) for f in frames), bytes_read=sum(os.path.getsize(p) for p in paths))
+        return pd.concat(frames, ignore_index=True)
+
+    def write(self, df: pd.DataFrame, cids=None) -> int:
+        """Rewrite the shards holding cids (all when None); returns how many were written."""
+        m = self.manifest()
+        shard = self.shard_of(m["bounds"], df["customer_id"].to_numpy(dtype=np.int64))
+        order = np.argsort(shard, kind="stable")
+        cuts = np.searchsorted(shard[order], np.arange(len(m["files"]) + 1))
+        if cids is None:
+            targets = range(len(m["files"]))
+        else:
+            targets = sorted(set(self.shard_of(m["bounds"], np.fromiter(cids, dtype=np.int64)).tolist()))
+        jobs = [(df.iloc[order[cuts[i]:cuts[i + 1]]], os.path.join(self.root, m["files"][i]), m["format"])
+                for i in targets]
+        with METRICS.span("write_shards"):
+            sizes = self._map(_write_shard, jobs, sum(len(j[0]) for j in jobs))
+            METRICS.note(rows=sum(len(j[0]) for j in jobs), bytes_written=sum(sizes))
+        for i, job in zip(targets, jobs):
+            m["rows"][i] = len(job[0])
+        self._save_manifest(m)
+        return len(jobs)
+
+    def create(self, df: pd.DataFrame, n: int, fmt: Optional[str] = None) -> None:
+        """
+        (Re)split df into n ranges of equal row count. The files get a new
+        generation number, so the old manifest stays valid until the new one
+        replaces it; files it no longer lists are removed afterwards.
+        """
+        backend = get_backend(fmt)
+        os.makedirs(self.root, exist_ok=True)
+        gen = self.manifest().get("generation", 0) + 1 if self.exists() else 1
+        cids = np.sort(df["customer_id"].to_numpy(dtype=np.int64))
+        n = max(1, min(n, len(cids)))
+        bounds = [0] + [int(cids[i * len(cids) // n]) for i in range(1, n)]
+        m = {"generation": gen, "format": backend.name, "bounds": bounds,
+             "files": [f"shard_{gen:04d}_{i:03d}{backend.suffix}" for i in range(n)], "rows": [0] * n}
+        shard = self.shard_of(bounds, df["customer_id"].to_numpy(dtype=np.int64))
+        order = np.argsort(shard, kind="stable")
+        cuts = np.searchsorted(shard[order], np.arange(n + 1))
+        jobs = [(df.iloc[order[cuts[i]:cuts[i + 1]]], os.path.join(self.root, m["files"][i]), backend.name)
+                for i in range(n)]
+        self._map(_write_shard, jobs, len(df))
+        m["rows"] = [len(j[0]) for j in jobs]
+        self._save_manifest(m)
+        self._remove_unlisted(m["files"])
+
+    def _remove_unlisted(self, keep: List[str]) -> None:
+        for name in os.listdir(self.root):
+            if name.startswith("shard_") and name not in keep:
+                os.remove(os.path.join(self.root, name))
+
+    def remove(self) -> None:
+        """Drop the layout (manifest first, so a crash leaves no half-listed shards)."""
+        os.remove(self.manifest_path)
+        self._remove_unlisted([])
+        try:
+            os.rmdir(self.root)
+        except OSError:
+            pass
+
+    def stale_tmp(self) -> List[str]:
+        """Shard or manifest .tmp files a crash left behind."""
+        if not os.path.isdir(self.root):
+            return []
+        return [os.path.join(self.root, n) for n in os.listdir(self.root) if n.endswith(".tmp")]
+
+SHARDS = ShardSet()
+
+def data_location() -> str:
+    """Where the customers are stored: the data file or SHARD_DIR."""
+    return f"{SHARDS.root}/" if SHARDS.exists() else data_path()
+
+@instrumented()
+def shard_storage(n: int) -> None:
+    """Split the customer data into n customer_id-range shards (n <= 1 merges them back)."""
+    store = get_store()
+    df = store.df
+    store.flush()
+    if n <= 1:
+        if not SHARDS.exists():
+            cli_info(f"Data is already in one file ({data_path()}).")
+            return
+        with CommitLock() as lock:
+            atomic_write(df, data_path())
+            SHARDS.remove()
+            store._seq = lock.advance()
+        cli_info(f"Merged {len(df)} records into {data_path()}.")
+        append_audit("shard_storage", f"merged, rows={len(df)}")
+        return
+    with CommitLock() as lock:
+        SHARDS.create(df, n)
+        if os.path.exists(data_path()):
+            os.remove(data_path())   # the shards hold the same rows now
+        store._seq = lock.advance()
+    m = SHARDS.manifest()
+    cli_info(f"Split {len(df)} records into {len(m['files'])} shards in {SHARDS.root}/ "
+             f"(rows per shard: {', '.join(map(str, m['rows']))}).")
+    append_audit("shard_storage", f"shards={len(m['files'])}, rows={len(df)}")
+
 def init_storage():
    
-    """Create main CSV if missing with correct header. Use pandas only."""
+    """Create the main data file if missing with correct header."""
    
-    try:
-        pd.read_csv(DATA_FILE)
-        cli_info(f"Using existing {DATA_FILE}.")
-  
-    except Exception:
-        df_empty = pd.DataFrame(columns=COLUMNS)
-        df_empty.to_csv(DATA_FILE, index=False)
-        cli_info(f"Created {DATA_FILE} with header.")
+    path = data_path()
+    if SHARDS.exists():
+        cli_info(f"Using sharded data in {SHARDS.root}/ ({len(SHARDS.manifest()['files'])} shards).")
+    elif os.path.exists(path):
+        cli_info(f"Using existing {path}.")
+    else:
+        get_backend().write(pd.DataFrame(columns=COLUMNS), path)
+        cli_info(f"Created {path} with header.")
   
     # ensure audit file exists
 
-    try:
-        pd.read_csv(AUDIT_FILE)
-    except Exception:
-        pd.DataFrame(columns=["timestamp", "action", "detail"]).to_csv(AUDIT_FILE, index=False)
-    # ensure backup file exists optionally
-    try:
-        pd.read_csv(BACKUP_FILE)
-    except Exception:
-        pd.DataFrame(columns=COLUMNS).to_csv(BACKUP_FILE, index=False)
+    if not os.path.exists(AUDIT_FILE):
+        pd.DataFrame(columns=AUDIT_COLUMNS).to_csv(AUDIT_FILE, index=False)
+    # ensure backup folder exists
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    recover_journal()
 
+def read_data_file(path: str, fmt: Optional[str] = None) -> pd.DataFrame:
+    """Read any customer file in the given format and normalize schema."""
+    return _ensure_schema(get_backend(fmt).read(path))
+
+@instrumented()
 def load_data() -> pd.DataFrame:
-    """Load CSV into DataFrame and normalize schema."""
-    try:
-        df = pd.read_csv(DATA_FILE, dtype=str)
-    except Exception:
-        # create and reload
-        df = pd.DataFrame(columns=COLUMNS)
-        df.to_csv(DATA_FILE, index=False)
-        df = pd.read_csv(DATA_FILE, dtype=str)
-    df = _ensure_schema(df)
+    """Load the data file (or the shards) into a DataFrame and normalize schema."""
+    if SHARDS.exists():
+        df = apply_compact_dtypes(_ensure_schema(SHARDS.load()))
+        METRICS.note(rows=len(df))
+        return df
+    backend = get_backend()
+    path = data_path()
+    with METRICS.span(f"read_{backend.name}"):
+        try:
+            df = backend.read(path)
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            # create and reload
+            backend.write(pd.DataFrame(columns=COLUMNS), path)
+            df = backend.read(path)
+        if METRICS.active:
+            METRICS.note(rows=len(df), bytes_read=os.path.getsize(path))
+    df = apply_compact_dtypes(_ensure_schema(df))
+    METRICS.note(rows=len(df))
     return df
 
 def save_data(df: pd.DataFrame) -> None:
-    """Save DataFrame to CSV, ensuring schema and default columns."""
-    df_out = _ensure_schema(df.copy())
-    df_out.to_csv(DATA_FILE, index=False)
-    cli_info(f"Saved {len(df_out)} records to {DATA_FILE}")
+    """Save DataFrame to the data file, ensuring schema and default columns."""
+    _write_data(_ensure_schema(df.copy()))
+
+def _fsync_dir(path: str) -> None:
+    """fsync the directory holding path so a rename is durable (POSIX only)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@instrumented()
+def atomic_write(df: pd.DataFrame, path: str, fmt: Optional[str] = None) -> None:
+    """
+    Write df to path.tmp with the storage backend, fsync it and rename it over
+    path, so a crash leaves either the old or the new file, never a torn one.
+    """
+    tmp = path + ".tmp"
+    get_backend(fmt).write(df, tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+        if METRICS.active:
+            METRICS.note(rows=len(df), bytes_written=os.fstat(f.fileno()).st_size)
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+@instrumented("save_data")
+def _write_data(df_out: pd.DataFrame, cids=None) -> None:
+    """
+    Write an already-normalized frame to the data file. With shards, only
+    those holding the given customer IDs are rewritten (all when None).
+    """
+    METRICS.note(rows=len(df_out))
+    if SHARDS.exists():
+        written = SHARDS.write(df_out, cids)
+        cli_info(f"Saved {len(df_out)} records to {SHARDS.root}/ "
+                 f"({written} of {len(SHARDS.manifest()['files'])} shards rewritten)")
+        append_audit("save_data", f"Saved {len(df_out)} records, shards={written}")
+        return
+    path = data_path()
+    atomic_write(df_out, path)
+    cli_info(f"Saved {len(df_out)} records to {path}")
     append_audit("save_data", f"Saved {len(df_out)} records")
 
+# -------------------------
+# Incremental backups
+# -------------------------
+# backups/manifest.json lists generations oldest first. A "full" generation
+# stores every row; a "delta" stores only rows whose hash changed since the
+# previous generation plus the IDs deleted since then. state_hashes.npz holds
+# the row hashes of the latest generation to diff the next backup against.
+
+def _backup_file(name: str) -> str:
+    return os.path.join(BACKUP_DIR, name)
+
+def _read_manifest() -> Dict[str, Any]:
+    try:
+        with open(_backup_file("manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"generations": []}
+
+def _write_manifest(manifest: Dict[str, Any]) -> None:
+    path = _backup_file("manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """One uint64 per row over all COLUMNS, independent of in-memory dtypes."""
+    return pd.util.hash_pandas_object(_typed_for_binary(df), index=False).to_numpy()
+
+@instrumented()
 def backup_data():
-    """Create a simple backup by copying DataFrame to BACKUP_FILE."""
+    """
+    Create the next backup generation: a full copy for the first one (and
+    every BACKUP_FULL_EVERY after), otherwise only the rows that changed.
+    Returns the manifest entry, or None if the backup failed.
+    """
     try:
-        df = load_data()
-        df.to_csv(BACKUP_FILE, index=False)
-        cli_info(f"Backup saved to {BACKUP_FILE}")
-        append_audit("backup", f"Backup created ({len(df)} rows)")
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        df = get_store().df
+        manifest = _read_manifest()
+        gens = manifest["generations"]
+        gen = gens[-1]["gen"] + 1 if gens else 1
+        fmt = get_backend().name
+        cids = df["customer_id"].to_numpy(dtype="int64")
+        hashes = row_hashes(df)
+        since_full = 0
+        for g in reversed(gens):
+            if g["kind"] == "full":
+                break
+            since_full += 1
+        hash_path = _backup_file("state_hashes.npz")
+        entry = {"gen": gen, "format": fmt, "rows": len(df)}
+        if not gens or since_full >= BACKUP_FULL_EVERY or not os.path.exists(hash_path):
+            entry.update(kind="full", file=f"gen_{gen:05d}_full{get_backend().suffix}", changed=len(df), deleted=0)
+            atomic_write(df, _backup_file(entry["file"]))
+        else:
+            with np.load(hash_path) as z:
+                prev_cids, prev_hashes = z["customer_id"], z["hash"]
+            pos = pd.Index(prev_cids).get_indexer(cids)
+            changed = (pos < 0) | (prev_hashes[np.maximum(pos, 0)] != hashes)
+            deleted = np.setdiff1d(prev_cids, cids)
+            entry.update(kind="delta", file=f"gen_{gen:05d}_delta{get_backend().suffix}",
+                         changed=int(changed.sum()), deleted=len(deleted))
+            atomic_write(df[changed], _backup_file(entry["file"]))
+            if len(deleted):
+                entry["deleted_file"] = f"gen_{gen:05d}_deleted.npy"
+                np.save(_backup_file(entry["deleted_file"]), deleted)
+        with open(hash_path + ".tmp", "wb") as f:
+            np.savez(f, customer_id=cids, hash=hashes)
+        os.replace(hash_path + ".tmp", hash_path)
+        gens.append(entry)
+        _prune_backups(manifest)
+        _write_manifest(manifest)
+        cli_info(f"Backup generation {gen} ({entry['kind']}, {entry['changed']} rows, "
+                 f"{entry['deleted']} deletions) saved in {BACKUP_DIR}/")
+        append_audit("backup", f"gen={gen}, kind={entry['kind']}, changed={entry['changed']}, rows={len(df)}")
+        return entry
     except Exception as e:
         cli_error(f"Backup failed: {e}")
+        return None
 
-def next_customer_id(df: pd.DataFrame) -> int:
-    if df.empty:
-        return 1
-    return int(df["customer_id"].max()) + 1
+def _prune_backups(manifest: Dict[str, Any]) -> None:
+    """
+    Keep at least BACKUP_KEEP generations. Whole chains (a full generation
+    and its deltas) are dropped, oldest first, while the generations after
+    them still number BACKUP_KEEP and start with a full one.
+    """
+    gens = manifest["generations"]
+    while True:
+        fulls = [i for i, g in enumerate(gens) if g["kind"] == "full"]
+        if len(fulls) < 2 or len(gens) - fulls[1] < BACKUP_KEEP:
+            break
+        for g in gens[:fulls[1]]:
+            for key in ("file", "deleted_file"):
+                if key in g and os.path.exists(_backup_file(g[key])):
+                    os.remove(_backup_file(g[key]))
+        del gens[:fulls[1]]
+
+def list_backups() -> List[Dict[str, Any]]:
+    return _read_manifest()["generations"]
+
+def rebuild_backup(gen: int) -> pd.DataFrame:
+    """Reconstruct the customer table as it was at backup generation gen."""
+    gens = list_backups()
+    upto = [g for g in gens if g["gen"] <= gen]
+    if not upto or upto[-1]["gen"] != gen:
+        raise ValueError(f"Backup generation {gen} not found")
+    start = max(i for i, g in enumerate(upto) if g["kind"] == "full")
+    base = upto[start]
+    df = read_data_file(_backup_file(base["file"]), base["format"]).reset_index(drop=True)
+    for g in upto[start + 1:]:
+        delta = read_data_file(_backup_file(g["file"]), g["format"])
+        pos = pd.Index(df["customer_id"]).get_indexer(delta["customer_id"])
+        hit = pos >= 0
+        for col in COLUMNS:
+            values = df[col].to_numpy(dtype=object if df[col].dtype != delta[col].dtype else None, copy=True)
+            values[pos[hit]] = delta[col].to_numpy()[hit]
+            df[col] = values
+        df = pd.concat([df, delta[~hit]], ignore_index=True)
+        if "deleted_file" in g:
+            deleted = np.load(_backup_file(g["deleted_file"]))
+            df = df[~df["customer_id"].isin(deleted)].reset_index(drop=True)
+    return _ensure_schema(df)
+
+@instrumented()
+def restore_backup_interactive() -> None:
+    gens = list_backups()
+    if not gens:
+        cli_warn("No backups yet.")
+        return
+    print(pd.DataFrame(gens)[["gen", "kind", "rows", "changed", "deleted"]].to_string(index=False))
+    gen = read_int("Generation to restore: ", default=gens[-1]["gen"])
+    if confirm(f"Replace current data with generation {gen}? (y/n): "):
+        restore_backup(gen)
+    else:
+        cli_info("Restore cancelled.")
+
+def restore_backup(gen: int) -> None:
+    """Replace the live data with backup generation gen (saved immediately)."""
+    try:
+        df = rebuild_backup(gen)
+    except Exception as e:
+        cli_error(f"Restore failed: {e}")
+        return
+    store = get_store()
+    store.assign(apply_compact_dtypes(df))
+    store.flush()
+    cli_info(f"Restored {len(df)} records from backup generation {gen}.")
+    append_audit("restore_backup", f"gen={gen}, rows={len(df)}")
+
+@instrumented()
+def migrate_storage(src_fmt: str, dst_fmt: str) -> None:
+    """One-shot conversion of the data file (or every shard) between storage formats."""
+    if SHARDS.exists():
+        try:
+            with CommitLock() as lock:
+                df = SHARDS.load()
+                SHARDS.create(df, len(SHARDS.manifest()["files"]), dst_fmt)
+                lock.advance()
+        except Exception as e:
+            cli_error(f"Migration failed: {e}")
+            return
+        cli_info(f"Migrated {len(df)} records in {SHARDS.root}/ to {dst_fmt}.")
+        append_audit("migrate_storage", f"{SHARDS.root} -> {dst_fmt}, rows={len(df)}")
+        return
+    try:
+        src, dst = data_path(src_fmt), data_path(dst_fmt)
+        df = read_data_file(src, src_fmt)
+        atomic_write(df, dst, dst_fmt)
+    except FileNotFoundError as e:
+        cli_error(f"{e.filename} not found.")
+        return
+    except Exception as e:
+        cli_error(f"Migration failed: {e}")
+        return
+    cli_info(f"Migrated {len(df)} records from {src} to {dst}")
+    cli_info(f"Set WATER_STORAGE_FORMAT={dst_fmt} to use it.")
+    append_audit("migrate_storage", f"{src} -> {dst}, rows={len(df)}")
+
+@instrumented()
+def memory_report() -> pd.DataFrame:
+    """
+    Print and return in-memory bytes per column for the data file as plain
+    _ensure_schema output ("before") and with SCHEMA_DTYPES applied ("after").
+    """
+    plain = _ensure_schema(SHARDS.load() if SHARDS.exists() else get_backend().read(data_path()))
+    plain["paid"] = plain["paid"].astype(object)  # as it used to be held
+    compact = apply_compact_dtypes(_ensure_schema(plain.copy()))
+    report = pd.DataFrame({
+        "dtype_before": plain.dtypes.astype(str),
+        "bytes_before": plain.memory_usage(deep=True, index=False),
+        "dtype_after": compact.dtypes.astype(str),
+        "bytes_after": compact.memory_usage(deep=True, index=False),
+    })
+    report.loc["TOTAL"] = ["", report["bytes_before"].sum(), "", report["bytes_after"].sum()]
+    print("\n--- MEMORY (bytes per column) ---")
+    print(report.to_string())
+    return report
+
+def next_customer_id(df: Optional[pd.DataFrame] = None) -> int:
+    """Next free customer id; kept for callers of the old API, the store tracks it."""
+    return get_store().next_id()
+
+# -------------------------
+# Advisory locks
+# -------------------------
+# Several terminals may run the portal on the same files. Each session
+# keeps its own journal slot locked while it runs, and commits (see
+# DataStore.flush) take LOCK_FILE only for the few moments they write.
+
+def _lock_file(f, blocking: bool = True) -> bool:
+    """Exclusive advisory lock on an open file; False if non-blocking and held elsewhere."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def _open_lock(path: str):
+    """Lock file handle for _acquire (created if missing, never truncated)."""
+    return os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+", encoding="utf-8")
+
+def _acquire(f, path: str) -> None:
+    """Blocking lock with a few retries; OSError if the lock cannot be taken at all."""
+    for attempt in range(LOCK_RETRIES):
+        if _lock_file(f):
+            return
+        time.sleep(0.05 * (attempt + 1))
+    raise OSError(f"could not lock {path} (file locking unsupported or failing here)")
+
+def _unlock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class CommitLock:
+    """
+    LOCK_FILE held for one commit window. The file also stores the commit
+    sequence number, advanced after every committed write: a session that
+    still sees the number it loaded at knows nobody else committed since.
+    The time spent waiting for the lock is the contention metric.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or LOCK_FILE
+        self._fh = None
+        self.waited = 0.0
+
+    def __enter__(self) -> "CommitLock":
+        self._fh = _open_lock(self.path)
+        start = time.perf_counter()
+        try:
+            _acquire(self._fh, self.path)
+        except OSError:
+            self._fh.close()
+            self._fh = None
+            raise
+        self.waited = time.perf_counter() - start
+        if METRICS.enabled:
+            METRICS.record("commit_lock_wait", self.waited)
+        return self
+
+    def __exit__(self, *exc):
+        _unlock_file(self._fh)
+        self._fh.close()
+        self._fh = None
+        return False
+
+    def sequence(self) -> int:
+        self._fh.seek(0)
+        text = self._fh.read().strip()
+        return int(text) if text.isdigit() else 0
+
+    def advance(self) -> int:
+        """Record one more commit; call after the data is written."""
+        seq = self.sequence() + 1
+        self._fh.seek(0)
+        self._fh.truncate()
+        self._fh.write(str(seq))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        return seq
+
+def read_commit_sequence() -> Optional[int]:
+    """Commit sequence number read without the lock (None if mid-write or unreadable)."""
+    try:
+        with open(LOCK_FILE, encoding="utf-8") as f:
+            text = f.read().strip()
+    except FileNotFoundError:
+        return 0
+    return int(text) if text.isdigit() else None
+
+# -------------------------
+# Write-ahead journal
+# -------------------------
+def _json_default(o):
+    # numpy scalars coming out of the frame
+    if hasattr(o, "item"):
+        return o.item()
+    raise TypeError(f"not JSON serializable: {type(o).__name__}")
+
+def journal_slot(n: int) -> str:
+    """water_data.journal, water_data.2.journal, ... (one per concurrent session)."""
+    if n <= 1:
+        return JOURNAL_FILE
+    root, ext = os.path.splitext(JOURNAL_FILE)
+    return f"{root}.{n}{ext}"
+
+def journal_slots() -> List[str]:
+    """Journal slot files present on disk."""
+    out = []
+    while os.path.exists(journal_slot(len(out) + 1)):
+        out.append(journal_slot(len(out) + 1))
+    return out
+
+class Journal:
+    """
+    Append-only log of point mutations (add, update, delete) made since the
+    data file was last saved. Each line is "<crc32>\t<json>" and is fsynced
+    before the edit counts as done; replaying the log over the saved file
+    rebuilds the in-memory state after a crash. A line with a bad checksum
+    (torn write) ends the log: it and anything after it are discarded.
+
+    Each session claims the first journal slot it can lock and holds the lock
+    while it runs; a non-empty slot nobody holds was left by a session that
+    ended without saving, and orphans() hands it to the next session.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._fh = None
+        self._slot: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or self._slot or JOURNAL_FILE
+
+    def claim(self) -> None:
+        """Open and lock this session's journal slot (once)."""
+        if self._fh is not None:
+            return
+        if self._path:
+            self._fh = open(self._path, "a", encoding="utf-8")
+            return
+        for n in range(1, JOURNAL_MAX_SLOTS + 1):
+            fh = open(journal_slot(n), "a", encoding="utf-8")
+            if _lock_file(fh, blocking=False):
+                self._fh, self._slot = fh, journal_slot(n)
+                return
+            fh.close()
+        raise OSError(f"no free journal slot after {JOURNAL_MAX_SLOTS} tries "
+                      "(too many sessions, or file locking unsupported here)")
+
+    def orphans(self) -> List[Any]:
+        """Locked handles of other non-empty slots whose sessions have ended."""
+        out = []
+        for path in journal_slots():
+            if path == self.path or os.path.getsize(path) == 0:
+                continue
+            fh = open(path, "a", encoding="utf-8")
+            if _lock_file(fh, blocking=False):
+                out.append(fh)
+            else:
+                fh.close()
+        return out
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        payload = json.dumps(entry, default=_json_default, separators=(",", ":"))
+        line = f"{zlib.crc32(payload.encode('utf-8')):08x}\t{payload}\n"
+        self.claim()
+        with METRICS.span("journal_append"):
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            METRICS.note(rows=1, bytes_written=len(line))
+
+    def read(self, path: Optional[str] = None):
+        """Return (complete entries, number of discarded lines) of this (or another) slot."""
+        path = path or self.path
+        if not os.path.exists(path):
+            return [], 0
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = f.read().split("\n")
+        if lines and lines[-1] == "":
+            lines.pop()
+        entries = []
+        for i, line in enumerate(lines):
+            crc, _, payload = line.partition("\t")
+            try:
+                ok = int(crc, 16) == zlib.crc32(payload.encode("utf-8"))
+                entry = json.loads(payload) if ok else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                return entries, len(lines) - i
+            entries.append(entry)
+        return entries, 0
+
+    @staticmethod
+    def _truncate(fh) -> None:
+        fh.flush()
+        os.ftruncate(fh.fileno(), 0)
+        os.fsync(fh.fileno())
+
+    def reset(self) -> None:
+        """Empty the journal once its edits are in a saved data file (the slot stays locked)."""
+        if self._fh is not None:
+            self._truncate(self._fh)
+            return
+        with open(self.path, "w", encoding="utf-8") as f:
+            os.fsync(f.fileno())
+
+    def release(self, orphans: List[Any]) -> None:
+        """Empty adopted orphan slots once their edits are committed, and unlock them."""
+        for fh in orphans:
+            self._truncate(fh)
+            _unlock_file(fh)
+            fh.close()
+
+# -------------------------
+# Session data store
+# -------------------------
+# Flush policies: write every mutation through, every FLUSH_EVERY mutations,
+# or only on logout/exit. Point edits are journaled first, so the lazier
+# policies lose nothing on a crash; bulk edits are always saved at once.
+FLUSH_IMMEDIATE = "immediate"
+FLUSH_EVERY_N = "every_n"
+FLUSH_ON_EXIT = "on_exit"
+FLUSH_POLICY = FLUSH_EVERY_N
+FLUSH_EVERY = 20
+
+class DataStore:
+    """
+    Customer table loaded once per session and kept typed in memory.
+    Admin actions mutate it through add/update/update_where/delete; the store
+    remembers which customer IDs are dirty and writes the data file back according
+    to its flush policy instead of a load_data/save_data cycle per action.
+
+    It also maintains a customer_id -> row label hash index (labels stay
+    stable across deletes, new rows get fresh labels) and the highest ID in
+    use, so lookups and next_id() never scan the customer_id column.
+
+    With journal=True, add/update/delete are written to the Journal before
+    they count, and load() replays any journal left behind by a crash.
+
+    Several sessions can share the files: every row carries a row_version
+    and flush() commits optimistically under a short CommitLock. If another
+    session committed since this one loaded, the commit starts from the file
+    as it is now and re-applies this session's dirty rows whose version there
+    is still the one they were edited from; rows changed on both sides keep
+    the committed values (a conflict, reported) and new rows whose ID was
+    taken meanwhile get the next free one. self.contention counts it all.
+
+    Derived structures (search index, ...) subscribe() to the store and get
+    these callbacks, each optional and called after the change:
+      reset(store)           the frame was (re)loaded or replaced
+      added(store, new)      rows appended (new is the appended frame)
+      updated(store, old)    previous values of the changed columns, indexed by customer_id
+      deleted(store, old)    the removed row(s), indexed by customer_id
+    """
+
+    def __init__(self, policy: Optional[str] = None, every: Optional[int] = None,
+                 journal: bool = True):
+        self.policy = policy or FLUSH_POLICY
+        self.every = max(int(every or FLUSH_EVERY), 1)
+        self.journal = Journal() if journal else None
+        self._replaying = False
+        self._df: Optional[pd.DataFrame] = None
+        self._pos: Dict[int, Any] = {}
+        self._next_label = 0
+        self.max_id = 0
+        self.dirty: set = set()
+        self.mutations = 0
+        self.observers: List[Any] = []
+        self._seq: Optional[int] = None        # commit sequence the frame was loaded/committed at
+        self._new: set = set()                 # IDs added since the last commit
+        self._gone: Dict[int, int] = {}        # IDs deleted since the last commit -> their row_version
+        self._overwrite = False                # assign(): commit the frame as-is, no merge
+        self._orphans: List[Any] = []          # adopted journal slots of ended sessions
+        self.contention = {"commits": 0, "merged": 0, "conflicts": 0, "renumbered": 0, "lock_wait_s": 0.0}
+
+    def subscribe(self, observer) -> None:
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def _emit(self, event: str, *args) -> None:
+        for obs in self.observers:
+            fn = getattr(obs, event, None)
+            if fn is not None:
+                fn(self, *args)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        if self._df is None:
+            self.load()
+        return self._df
+
+    def load(self) -> None:
+        """(Re)read the data file plus any journaled edits not yet saved into it."""
+        if self.journal is not None:
+            self.journal.claim()
+        self._seq = read_commit_sequence()   # read first: a commit after it makes the next flush merge
+        self._df = load_data()
+        self._reindex()
+        self.dirty.clear()
+        self._new.clear()
+        self._gone.clear()
+        self._overwrite = False
+        self.mutations = 0
+        if self.journal is not None:
+            self.recover()
+        self._emit("reset")
+
+    def recover(self) -> Dict[str, int]:
+        """
+        Replay complete journal entries over the loaded frame, save, and clear
+        the journal. Entries are absolute (values, not deltas) and add/delete
+        skip IDs already present/absent, so replaying over a file that already
+        contains them is harmless.
+        """
+        entries, discarded = self.journal.read()
+        self._orphans = self.journal.orphans()
+        for fh in self._orphans:
+            more, lost = self.journal.read(fh.name)
+            entries += more
+            discarded += lost
+        if not entries and not discarded:
+            return {"replayed": 0, "discarded": 0}
+        stale = 0
+        self._replaying = True
+        try:
+            for e in entries:
+                op = e.get("op")
+                if op == "add":
+                    rows = [r for r in e["rows"] if r["customer_id"] not in self._pos]
+                    if rows:
+                        self.add(rows)
+                elif op in ("update", "delete") and e["id"] in self._pos:
+                    # "v": row_version the edit was made on; skip it if another session committed the row since
+                    if e.get("v", self.version(e["id"])) != self.version(e["id"]):
+                        stale += 1
+                    elif op == "update":
+                        self.update(e["id"], e["values"])
+                    else:
+                        self.delete(e["id"])
+        finally:
+            self._replaying = False
+        if self.mutations:
+            self.flush()
+        else:
+            self.journal.reset()
+            self.journal.release(self._orphans)
+            self._orphans = []
+        if discarded:
+            cli_warn(f"Journal: discarded {discarded} incomplete entries.")
+        if stale:
+            cli_warn(f"Journal: skipped {stale} edits to rows another session changed since.")
+        cli_info(f"Journal: replayed {len(entries) - stale} edits into {data_location()}.")
+        append_audit("journal_recovery", f"replayed={len(entries) - stale}, stale={stale}, discarded={discarded}")
+        return {"replayed": len(entries) - stale, "discarded": discarded}
+
+    def _reindex(self) -> None:
+        """Rebuild the customer_id index from scratch (load / whole-frame replace)."""
+        df = self._df
+        cids = df["customer_id"].to_numpy()
+        labels = df.index.to_numpy()
+        # reversed so the first row wins if a hand-edited file repeats an ID
+        self._pos = dict(zip(cids[::-1].tolist(), labels[::-1].tolist()))
+        if len(self._pos) != len(df):
+            cli_warn(f"{len(df) - len(self._pos)} duplicate customer IDs in {data_location()}; first row used.")
+        self._next_label = int(labels.max()) + 1 if len(labels) else 0
+        self.max_id = max(self._pos, default=0)
+
+    def __contains__(self, cid) -> bool:
+        if self._df is None:
+            self.load()
+        return cid in self._pos
+
+    def position(self, cid: int):
+        """Row label of a customer, or None if the ID is unknown."""
+        if self._df is None:
+            self.load()
+        return self._pos.get(cid)
+
+    def positions(self, ids) -> pd.Series:
+        """Row labels for many customer IDs: a Series aligned with ids, NaN where unknown."""
+        if self._df is None:
+            self.load()
+        index = ids.index if isinstance(ids, pd.Series) else None
+        get = self._pos.get   # not Series.map(dict): that copies the whole dict per call
+        return pd.Series([get(c) for c in np.asarray(ids, dtype=np.int64).tolist()], index=index, dtype=float)
+
+    def next_id(self) -> int:
+        if self._df is None:
+            self.load()
+        return self.max_id + 1
+
+    def _label(self, cid: int):
+        idx = self.position(cid)
+        if idx is None:
+            raise KeyError(cid)
+        return idx
+
+    def version(self, cid: int) -> int:
+        """row_version of a customer as of this session's last load/commit."""
+        return int(self.df.at[self._label(cid), "row_version"])
+
+    def get(self, cid: int) -> Dict[str, Any]:
+        """Return one customer record as a dict (KeyError if unknown)."""
+        return self.df.loc[self._label(cid)].to_dict()
+
+    def _widen_categories(self, col: str, values) -> None:
+        """Make room for new values in a categorical column before assigning them."""
+        cats = self._df[col].cat.categories
+        missing = pd.Index(pd.unique(pd.Series(values).dropna())).difference(cats)
+        if len(missing):
+            self._df[col] = self._df[col].cat.add_categories(missing)
+
+    def _conform(self, col: str, values):
+        """Prepare values for assignment into a (possibly categorical) column."""
+        if isinstance(self._df[col].dtype, pd.CategoricalDtype):
+            self._widen_categories(col, [values] if np.isscalar(values) else values)
+        return values
+
+    def _conform_frame(self, new: pd.DataFrame) -> pd.DataFrame:
+        """Cast incoming rows to the store's compact dtypes so concat keeps them."""
+        df = self.df
+        for col in new.columns.intersection(df.columns):
+            dtype = df[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                self._widen_categories(col, new[col])
+                new[col] = pd.Categorical(new[col], categories=self._df[col].cat.categories)
+            elif new[col].dtype != dtype and {new[col].dtype.kind, dtype.kind} <= set("iu"):
+                # only integer width/sign (customer_id -> uint32); never float -> int
+                new[col] = new[col].astype(dtype)
+        return new
+
+    def add(self, records) -> None:
+        """Append new customers given as a list of dicts or a DataFrame."""
+        new = records if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+        if new.empty:
+            return
+        if "row_version" in new:
+            # rows are unversioned until their first commit; a blank row_version is 0
+            new = new.assign(row_version=pd.to_numeric(new["row_version"], errors="coerce").fillna(0).astype("int64"))
+        if self.df.empty:
+            new = apply_compact_dtypes(_ensure_schema(new.copy()))
+        else:
+            if new.columns.intersection(COLUMNS).size < len(COLUMNS):
+                # rows from older callers/journals lack newer columns (plan_id)
+                new = _ensure_schema(new.copy())
+            new = self._conform_frame(new)
+        df = self._df
+        new.index = pd.RangeIndex(self._next_label, self._next_label + len(new))
+        self._df = new if df.empty else pd.concat([df, new])
+        self._next_label += len(new)
+        for cid, label in zip(new["customer_id"].tolist(), new.index.tolist()):
+            self._pos.setdefault(int(cid), label)
+        self.max_id = max(self.max_id, int(new["customer_id"].max()))
+        self._new.update(int(c) for c in new["customer_id"])
+        self._emit("added", new)
+        entry = None
+        if len(new) <= JOURNAL_MAX_ADD_ROWS:
+            entry = {"op": "add", "rows": new.astype(object).to_dict("records")}
+        self.touch(new["customer_id"], entry)
+
+    def update(self, cid: int, values: Dict[str, Any]) -> None:
+        """Set several columns of one customer."""
+        idx = self._label(cid)
+        old = self._df.loc[[idx], list(values)].set_axis([cid])
+        for col, val in values.items():
+            self._df.at[idx, col] = self._conform(col, val)
+        self._emit("updated", old)
+        self.touch([cid], {"op": "update", "id": cid, "values": values, "v": self.version(cid)})
+
+    def update_where(self, mask, values: Dict[str, Any]) -> int:
+        """Set columns for every row selected by a boolean mask; returns row count."""
+        df = self.df
+        old = df.loc[mask, ["customer_id"] + list(values)].set_index("customer_id")
+        for col, val in values.items():
+            df.loc[mask, col] = self._conform(col, val)
+        self._emit("updated", old)
+        self.touch(old.index)
+        return len(old)
+
+    def changed(self, old: pd.DataFrame) -> None:
+        """
+        For bulk edits made directly on store.df: pass the previous values
+        (indexed by customer_id) so observers see an "updated" event, then
+        call touch() as usual.
+        """
+        self._emit("updated", old)
+
+    def delete(self, cid: int) -> None:
+        idx = self._label(cid)
+        old = self._df.loc[[idx]].set_index("customer_id")
+        version = int(old["row_version"].iloc[0])
+        if cid in self._new:
+            self._new.discard(cid)
+        else:
+            self._gone[cid] = version
+        self._df = self._df.drop(index=idx)
+        del self._pos[cid]
+        if cid == self.max_id:
+            # only deleting the top ID needs a rescan (of the index keys)
+            self.max_id = max(self._pos, default=0)
+        self._emit("deleted", old)
+        self.touch([cid], {"op": "delete", "id": cid, "v": version})
+
+    def assign(self, df: pd.DataFrame, cids=None) -> None:
+        """Replace the whole frame after an action rebuilt it (committed as-is, see flush)."""
+        self._df = df
+        self._overwrite = True
+        self._reindex()
+        self._emit("reset")
+        self.touch(df["customer_id"] if cids is None else cids)
+
+    def touch(self, cids, entry: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Record one mutation of the given customer IDs and apply the flush policy.
+        entry is its journal record; a mutation without one (bulk edits) is
+        saved right away when journaling, since it cannot be replayed.
+        """
+        self.dirty.update(int(c) for c in cids)
+        self.mutations += 1
+        if self._replaying:
+            return
+        if self.journal is not None:
+            if entry is None:
+                self.flush()
+                return
+            self.journal.append(entry)
+        if self.policy == FLUSH_IMMEDIATE:
+            self.flush()
+        elif self.policy == FLUSH_EVERY_N and self.mutations >= self.every:
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit the changes since the last flush (see the class notes on concurrency)."""
+        if self._df is None or self.mutations == 0:
+            return
+        with CommitLock() as lock:
+            self.contention["lock_wait_s"] += lock.waited
+            committed = lock.sequence()
+            if self._overwrite:
+                floor = int(self._df["row_version"].max()) if len(self._df) else 0
+                if committed != self._seq:
+                    disk = load_data()
+                    floor = max(floor, int(disk["row_version"].max()) if len(disk) else 0)
+                # above every version any session may hold, so their pending edits conflict
+                self._df["row_version"] = floor + 1
+            elif committed != self._seq:
+                self._merge_committed()
+            else:
+                labels = [self._pos[c] for c in self.dirty if c in self._pos]
+                self._df.loc[labels, "row_version"] += 1
+            _write_data(self._df, None if self._overwrite else self.dirty)
+            self._seq = lock.advance()
+        self.contention["commits"] += 1
+        METRICS.incr("commits")
+        if self.journal is not None:
+            self.journal.reset()
+            self.journal.release(self._orphans)
+            self._orphans = []
+        self.dirty.clear()
+        self._new.clear()
+        self._gone.clear()
+        self._overwrite = False
+        self.mutations = 0
+
+    def _merge_committed(self) -> None:
+        """
+        Rebase this session's dirty rows onto the data file as other sessions
+        left it (called under the CommitLock). self._df becomes the merged
+        table; self.dirty keeps only the IDs this commit still writes.
+        """
+        disk = load_data()
+        dirty = np.fromiter(self.dirty, dtype=np.int64, count=len(self.dirty))
+        where = pd.Index(disk["customer_id"].to_numpy(dtype=np.int64)).get_indexer(dirty)
+        on_disk = where >= 0
+        disk_v = np.full(len(dirty), -1, dtype=np.int64)
+        disk_v[on_disk] = disk["row_version"].to_numpy(dtype=np.int64)[where[on_disk]]
+        present = np.array([c in self._pos for c in dirty.tolist()], dtype=bool)
+        is_new = present & np.isin(dirty, list(self._new))
+        is_gone = ~present & np.isin(dirty, list(self._gone))
+        edited = present & ~is_new
+        base = np.full(len(dirty), -1, dtype=np.int64)
+        base[edited] = self._df.loc[[self._pos[c] for c in dirty[edited].tolist()], "row_version"].to_numpy()
+        base[is_gone] = [self._gone[c] for c in dirty[is_gone].tolist()]
+
+        take = edited & on_disk & (disk_v == base)          # our version of the row wins
+        drop = is_gone & on_disk & (disk_v == base)         # our delete goes through
+        conflict = (edited & ~take) | (is_gone & on_disk & ~drop)
+        mine = take | is_new
+        ours = self._df.loc[[self._pos[c] for c in dirty[mine].tolist()]].copy()
+        ours["row_version"] += 1
+
+        # new rows whose ID another session took meanwhile move to fresh IDs
+        renumbered = {}
+        next_id = max(int(disk["customer_id"].max()) if len(disk) else 0, self.max_id) + 1
+        for cid in dirty[is_new & on_disk].tolist():
+            renumbered[cid] = next_id
+            next_id += 1
+        if renumbered:
+            ours["customer_id"] = ours["customer_id"].replace(renumbered)
+
+        # keep the committed row order: replaced rows stay in their slot, new rows go last
+        keep = np.ones(len(disk), dtype=bool)
+        keep[where[take | drop]] = False
+        slot = np.concatenate([
+            np.flatnonzero(keep),
+            np.where(is_new[mine], len(disk) + np.arange(int(mine.sum())), where[mine]),
+        ])
+        merged = pd.concat([disk[keep], ours], ignore_index=True)
+        merged = merged.iloc[np.argsort(slot, kind="stable")].reset_index(drop=True)
+        self._df = apply_compact_dtypes(_ensure_schema(merged))
+        self._reindex()
+        self.dirty = {renumbered.get(c, c) for c in dirty[mine | drop].tolist()}
+
+        n_conflicts = int(conflict.sum())
+        self.contention["merged"] += 1
+        self.contention["conflicts"] += n_conflicts
+        self.contention["renumbered"] += len(renumbered)
+        METRICS.incr("commit_merges")
+        METRICS.incr("commit_conflicts", n_conflicts)
+        METRICS.incr("commit_renumbered", len(renumbered))
+        if n_conflicts:
+            ids = dirty[conflict].tolist()
+            shown = ", ".join(map(str, ids[:10])) + (" ..." if len(ids) > 10 else "")
+            cli_warn(f"{n_conflicts} customers were changed by another session since you loaded them; "
+                     f"your edits to them were dropped and the saved values kept (IDs: {shown}).")
+            append_audit("commit_conflict", f"ids={' '.join(map(str, ids))}")
+        for old_id, new_id in renumbered.items():
+            cli_warn(f"Customer ID {old_id} was taken by another session; your new customer is saved as {new_id}.")
+            append_audit("commit_renumber", f"{old_id} -> {new_id}")
+        self._emit("reset")
+
+_STORE: Optional[DataStore] = None
+
+def get_store() -> DataStore:
+    """Session store, created on first use (flushed at exit by flush_all)."""
+    global _STORE
+    if _STORE is None:
+        _STORE = DataStore()
+    return _STORE
+
+def recover_journal() -> None:
+    """Startup crash recovery: drop a half-written save, replay the journal."""
+    for tmp in [data_path() + ".tmp"] + SHARDS.stale_tmp():
+        if os.path.exists(tmp):
+            # the rename never happened, so the file itself is intact
+            os.remove(tmp)
+            cli_warn(f"Removed incomplete save {tmp}.")
+    if any(os.path.getsize(p) for p in journal_slots()):
+        get_store().load()
+
+def flush_all() -> None:
+    """Flush the session store, then the buffered audit rows it produced."""
+    if _STORE is not None:
+        _STORE.flush()
+    AUDIT.flush()
+    METRICS.write()
+
+atexit.register(flush_all)
+
+# -------------------------
+# Reading history
+# -------------------------
+# history/<period>.csv holds (customer_id, reading) rows appended as meter
+# reads arrive; the last row for a customer in a period wins, so a period
+# can be corrected by reading again. consumption = the period's reading
+# minus the customer's reading in the latest earlier period. A customer's
+# first recorded reading also records their current_reading from the
+# customer file as the opening reading of the period before.
+
+def current_period() -> str:
+    return time.strftime("%Y-%m")
+
+def _prev_period(period: str) -> str:
+    year, month = (int(p) for p in period.split("-"))
+    return f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+
+class ReadingHistory:
+    """
+    Append-only, period-partitioned reading store. Each partition is read
+    once, reduced to the last reading per customer, sorted by customer_id
+    and cached (until its file changes), so lookups are binary searches.
+    """
+
+    def __init__(self, directory: str = HISTORY_DIR):
+        self.directory = directory
+        self._cache: Dict[str, Any] = {}
+
+    def _path(self, period: str) -> str:
+        return os.path.join(self.directory, f"{period}.csv")
+
+    def periods(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-4] for n in names if n.endswith(".csv"))
+
+    def partition(self, period: str):
+        """(sorted customer_ids, readings) of one period; empty arrays if none."""
+        path = self._path(period)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        key = (st.st_mtime_ns, st.st_size)
+        hit = self._cache.get(period)
+        if hit is None or hit[0] != key:
+            part = pd.read_csv(path, dtype={"customer_id": "int64", "reading": float})
+            part = part.drop_duplicates("customer_id", keep="last").sort_values("customer_id")
+            hit = (key, part["customer_id"].to_numpy(), part["reading"].to_numpy())
+            self._cache[period] = hit
+        return hit[1], hit[2]
+
+    def append(self, period: str, cids, readings) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        rows = pd.DataFrame({"customer_id": np.asarray(cids, dtype=np.int64),
+                             "reading": np.asarray(readings, dtype=float)})
+        with open(self._path(period), "a", newline="", encoding="utf-8") as f:
+            rows.to_csv(f, header=f.tell() == 0, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def readings_before(self, cids, period: str) -> np.ndarray:
+        """Each customer's reading in the latest period before `period` (nan if none)."""
+        cids = np.asarray(cids, dtype=np.int64)
+        out = np.full(len(cids), np.nan)
+        for p in reversed([p for p in self.periods() if p < period]):
+            todo = np.flatnonzero(np.isnan(out))
+            if not len(todo):
+                break
+            ids, vals = self.partition(p)
+            pos = np.minimum(np.searchsorted(ids, cids[todo]), max(len(ids) - 1, 0))
+            hit = (ids[pos] == cids[todo]) if len(ids) else np.zeros(len(todo), dtype=bool)
+            out[todo[hit]] = vals[pos[hit]]
+        return out
+
+    def has_reading(self, cids, period: str) -> np.ndarray:
+        """Whether each customer already has a reading in period."""
+        ids, _ = self.partition(period)
+        cids = np.asarray(cids, dtype=np.int64)
+        return np.isin(cids, ids)
+
+    def record(self, cids, readings, current, period: Optional[str] = None) -> np.ndarray:
+        """
+        Store new readings for `period` (default: this month) and return the
+        previous reading consumption is measured from. current is the
+        customers' current_reading, used as the opening reading of anyone
+        with no earlier history.
+        """
+        period = period or current_period()
+        cids = np.asarray(cids, dtype=np.int64)
+        prev = self.readings_before(cids, period)
+        opening = np.isnan(prev)
+        if opening.any():
+            prev[opening] = np.asarray(current, dtype=float)[opening]
+            self.append(_prev_period(period), cids[opening], prev[opening])
+        self.append(period, cids, readings)
+        return prev
+
+    def customer_history(self, cid: int) -> pd.DataFrame:
+        """period, reading and consumption for one customer, oldest first."""
+        rows = []
+        for p in self.periods():
+            ids, vals = self.partition(p)
+            i = np.searchsorted(ids, cid)
+            if i < len(ids) and ids[i] == cid:
+                rows.append((p, float(vals[i])))
+        out = pd.DataFrame(rows, columns=["period", "reading"])
+        out["consumption"] = out["reading"].diff()
+        return out
+
+    def period_consumption(self, period: str) -> pd.DataFrame:
+        """customer_id, reading, previous and consumption for every customer read in period."""
+        ids, vals = self.partition(period)
+        prev = self.readings_before(ids, period)
+        return pd.DataFrame({"customer_id": ids, "reading": vals, "previous": prev,
+                             "consumption": vals - prev})
+
+    def rolling_average(self, window: int = 3, period: Optional[str] = None) -> pd.Series:
+        """Mean consumption per customer over the last `window` periods up to period."""
+        periods = [p for p in self.periods() if period is None or p <= period][-window:]
+        if not periods:
+            return pd.Series(dtype=float, name="rolling_avg")
+        frames = [self.period_consumption(p)[["customer_id", "consumption"]] for p in periods]
+        cons = pd.concat(frames, ignore_index=True)
+        return cons.groupby("customer_id")["consumption"].mean().rename("rolling_avg")
+
+READINGS = ReadingHistory()
 
 # =====================================================
 # PART 2: ADMIN CRUD OPERATIONS
 # Aditya Wankhade
 # =====================================================
 
+@instrumented()
 def add_customer():
-    df = load_data()
-    cid = next_customer_id(df)
+    store = get_store()
+    cid = store.next_id()
     cli_info(f"Adding new customer; assigned ID {cid}")
     name = input("Name: ").strip() or f"Customer{cid}"
     address = input("Address: ").strip()
@@ -225,88 +1894,498 @@ def add_customer():
         "tariff_per_unit": float(tariff),
         "last_updated": last_updated,
         "paid": False,
-        "paid_date": ""
+        "paid_date": "",
+        "plan_id": "",
+        "arrears": 0.0,
+        "overdue_periods": 0,
     }
-    df = pd.concat([df, pd.DataFrame([new])], ignore_index=True)
-    save_data(df)
+    store.add([new])
     append_audit("add_customer", f"id={cid}, name={name}")
     cli_info(f"Customer {cid} added successfully.")
 
+@instrumented()
 def update_consumption():
-    df = load_data()
+    store = get_store()
+    df = store.df
     if df.empty:
         cli_warn("No customers available to update.")
         return
     cid = read_int("Enter customer ID to update: ")
-    if cid not in df["customer_id"].values:
+    idx = store.position(cid)
+    if idx is None:
         cli_error("Customer ID not found.")
         return
-    idx = df.index[df["customer_id"] == cid][0]
-    prev = float(df.at[idx, "current_reading"])
-    cli_info(f"Previous reading for ID {cid}: {prev}")
-    new_read = read_float("Enter new current reading: ", default=prev)
-    # update readings
-    df.at[idx, "last_month_reading"] = prev
-    df.at[idx, "current_reading"] = float(new_read)
-    df.at[idx, "consumption"] = float(new_read) - float(prev)
+    shown = float(df.at[idx, "current_reading"])
+    cli_info(f"Previous reading for ID {cid}: {shown}")
+    new_read = read_float("Enter new current reading: ", default=shown)
+    period = read_period()
     # last_updated stored as manual note
     last_updated = input("Enter last_updated date (YYYY-MM-DD) [leave blank to keep]: ").strip()
+    # consumption runs from the previous period's reading (the current one if there is no history)
+    new_period = ~READINGS.has_reading([cid], period)
+    if not new_period[0]:
+        cli_info(f"ID {cid} already has a reading for {period}; this one replaces it as a correction "
+                 f"(consumption from the {_prev_period(period)} reading, arrears not rolled).")
+    arrears, aged = roll_arrears(df.loc[[idx]], new_period)
+    prev = float(READINGS.readings_before([cid], period)[0])
+    if np.isnan(prev):
+        prev = shown
+    changes = {
+        "last_month_reading": prev,
+        "current_reading": float(new_read),
+        "consumption": float(new_read) - float(prev),
+        "arrears": float(arrears[0]),
+        "overdue_periods": int(aged[0]),
+    }
     if last_updated:
-        df.at[idx, "last_updated"] = last_updated
-    df.at[idx, "paid"] = False
-    df.at[idx, "paid_date"] = ""
-    save_data(df)
+        changes["last_updated"] = last_updated
+    changes["paid"] = False
+    changes["paid_date"] = ""
+    store.update(cid, changes)
+    # the history gets the reading only once the store has it (an aborted prompt leaves neither)
+    READINGS.record([cid], [float(new_read)], [shown], period)
     append_audit("update_consumption", f"id={cid}, prev={prev}, new={new_read}")
     cli_info("Consumption updated and marked UNPAID.")
 
+@instrumented()
 def delete_customer():
-    df = load_data()
+    store = get_store()
+    df = store.df
     if df.empty:
         cli_warn("No customers to delete.")
         return
     cid = read_int("Enter customer ID to delete: ")
-    if cid not in df["customer_id"].values:
+    if cid not in store:
         cli_error("Customer not found.")
         return
     if confirm(f"Delete customer {cid}? This will create a backup first. (y/n): "):
         backup_data()
-        df = df[df["customer_id"] != cid].reset_index(drop=True)
-        save_data(df)
+        store.delete(cid)
         append_audit("delete_customer", f"id={cid}")
         cli_info(f"Customer {cid} deleted.")
     else:
         cli_info("Delete cancelled.")
 
-def view_all_customers(limit: Optional[int] = None):
-    df = load_data()
-    if df.empty:
+# -------------------------
+# Paged customer view
+# -------------------------
+# view_all_customers pages through row positions of the store frame instead
+# of a billed copy of it. A cursor is a sort order (one stable argsort per
+# column and direction) narrowed by a filter mask; both are cached until a
+# store event touches their columns. Showing a page bills and formats only
+# its PAGINATION_SIZE rows, and a cursor's inverse permutation finds the
+# page of a customer ID without a scan.
+VIEW_SORT_KEYS = ("customer_id", "name", "address", "consumption", "bill_amount", "arrears", "overdue_periods")
+VIEW_FILTER_COLUMNS = ("address", "plan_id")   # "<col>=<value>" filters; "unpaid" is built in
+VIEW_MAX_CURSORS = 8                           # cached (sort, filter) combinations
+BILL_COLUMNS = ("consumption", "tariff_per_unit", "plan_id")
+
+def _columns_of(key: str) -> Tuple[str, ...]:
+    """Store columns a sort key or filter is computed from."""
+    if key == "bill_amount":
+        return BILL_COLUMNS
+    if key == "unpaid":
+        return ("paid", "consumption", "arrears")
+    return (key,)
+
+def parse_view_filter(text: str) -> Optional[Tuple[str, ...]]:
+    """'unpaid' -> ("unpaid",), 'address=Chennai' -> ("address", "chennai"), '' -> None."""
+    text = text.strip()
+    if not text:
+        return None
+    if text.lower() == "unpaid":
+        return ("unpaid",)
+    col, sep, value = text.partition("=")
+    col = col.strip().lower()
+    if not sep or col not in VIEW_FILTER_COLUMNS:
+        raise ValueError(f"filter must be 'unpaid' or <col>=<value> with col in {', '.join(VIEW_FILTER_COLUMNS)}")
+    return (col, value.strip().lower())
+
+class CustomerView:
+    """
+    Cached sort orders and filtered cursors over the session store's rows
+    (positions for store.df.iloc), kept valid through DataStore events:
+    adds, deletes and reloads drop everything (positions move), an update
+    drops only what was computed from the changed columns.
+    """
+
+    def __init__(self):
+        self._orders: Dict[Tuple[str, bool], np.ndarray] = {}
+        self._cursors: Dict[Tuple[Any, ...], List[Any]] = {}   # key -> [positions, rank or None]
+
+    # store callbacks
+    def reset(self, store: "DataStore") -> None:
+        self.forget()
+
+    def added(self, store: "DataStore", new: pd.DataFrame) -> None:
+        self.forget()
+
+    def deleted(self, store: "DataStore", old: pd.DataFrame) -> None:
+        self.forget()
+
+    def updated(self, store: "DataStore", old: pd.DataFrame) -> None:
+        self.forget(*old.columns)
+
+    def forget(self, *columns: str) -> None:
+        """Drop cached orders/cursors using any of columns (all when none given)."""
+        if not columns:
+            self._orders.clear()
+            self._cursors.clear()
+            return
+        cols = set(columns)
+        stale = lambda key: bool(cols.intersection(_columns_of(key)))
+        self._orders = {k: v for k, v in self._orders.items() if not stale(k[0])}
+        self._cursors = {k: v for k, v in self._cursors.items()
+                         if not stale(k[0]) and not (k[2] and stale(k[2][0]))}
+
+    def _order(self, store: "DataStore", key: str, descending: bool) -> np.ndarray:
+        order = self._orders.get((key, descending))
+        if order is None:
+            df = store.df
+            col = bill_amounts(df) if key == "bill_amount" else df[key]
+            if col.dtype.kind not in "biuf":
+                col = col.astype(str).str.lower()
+            # dense ranks sort ties by position in both directions
+            _, ranks = np.unique(col.to_numpy(), return_inverse=True)
+            order = np.argsort(-ranks if descending else ranks, kind="stable")
+            self._orders[(key, descending)] = order
+        return order
+
+    def _mask(self, store: "DataStore", where: Tuple[str, ...]) -> np.ndarray:
+        df = store.df
+        if where[0] == "unpaid":
+            return _is_unpaid(df)
+        col = df[where[0]]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            hit = np.flatnonzero(col.cat.categories.astype(str).str.lower() == where[1])
+            return np.isin(col.cat.codes.to_numpy(), hit)
+        return (col.astype(str).str.lower() == where[1]).to_numpy()
+
+    def rows(self, store: "DataStore", sort: str = "customer_id", descending: bool = False,
+             where: Optional[Tuple[str, ...]] = None) -> np.ndarray:
+        """Positions of the matching rows in display order."""
+        return self._cursor(store, sort, descending, where)[0]
+
+    def _cursor(self, store, sort, descending, where) -> List[Any]:
+        if sort not in VIEW_SORT_KEYS:
+            raise ValueError(f"cannot sort by '{sort}' (choose from {', '.join(VIEW_SORT_KEYS)})")
+        key = (sort, descending, where)
+        cur = self._cursors.get(key)
+        if cur is None:
+            order = self._order(store, sort, descending)
+            if where is not None:
+                order = order[self._mask(store, where)[order]]
+            while len(self._cursors) >= VIEW_MAX_CURSORS:
+                del self._cursors[next(iter(self._cursors))]
+            cur = self._cursors[key] = [order, None]
+        return cur
+
+    def locate(self, store: "DataStore", cid: int, sort: str = "customer_id", descending: bool = False,
+               where: Optional[Tuple[str, ...]] = None) -> Optional[int]:
+        """Index of customer cid within rows(...), or None if absent / filtered out."""
+        label = store.position(cid)
+        if label is None:
+            return None
+        cur = self._cursor(store, sort, descending, where)
+        if cur[1] is None:
+            rank = np.full(len(store.df), -1, dtype=np.int64)
+            rank[cur[0]] = np.arange(len(cur[0]))
+            cur[1] = rank
+        i = int(cur[1][store.df.index.get_loc(label)])
+        return i if i >= 0 else None
+
+    def page(self, store: "DataStore", rows: np.ndarray, page: int,
+             page_size: int = PAGINATION_SIZE) -> pd.DataFrame:
+        """The rows of one page with their bill_amount."""
+        out = store.df.iloc[rows[page * page_size:(page + 1) * page_size]].copy()
+        out["bill_amount"] = bill_amounts(out)
+        return out
+
+CUSTOMER_VIEW = CustomerView()
+
+@instrumented()
+def view_all_customers(limit: Optional[int] = None, sort: str = "customer_id", descending: bool = False,
+                       where: Optional[Tuple[str, ...]] = None):
+    store = get_store()
+    if store.df.empty:
         cli_warn("No data.")
         return
-    disp = df.copy()
-    disp["bill_amount"] = disp.apply(lambda r: calculate_bill_row(r), axis=1)
+    store.subscribe(CUSTOMER_VIEW)
     if limit is not None:
-        pretty_print_df(disp.head(limit))
-    else:
-        paginate_df(disp)
+        pretty_print_df(CUSTOMER_VIEW.page(store, CUSTOMER_VIEW.rows(store, sort, descending, where), 0, limit))
+        return
+    page_size = PAGINATION_SIZE
+    page = 0
+    while True:
+        rows = CUSTOMER_VIEW.rows(store, sort, descending, where)
+        total = len(rows)
+        pages = max((total + page_size - 1) // page_size, 1)
+        page = min(page, pages - 1)
+        start = page * page_size
+        label = f"sorted by {sort}{' desc' if descending else ''}" + (f", filter {'='.join(where)}" if where else "")
+        print(f"\n-- Page {page+1}/{pages} -- (showing rows {min(start+1, total)} to {min(start+page_size, total)} of {total}; {label})")
+        pretty_print_df(CUSTOMER_VIEW.page(store, rows, page, page_size))
+        cmd = input("n=next, p=prev, g N=page, c ID=customer, s COL [desc]=sort, f unpaid|address=X|(blank)=filter, q=quit: ").strip()
+        op, _, arg = cmd.partition(" ")
+        op = op.lower()
+        arg = arg.strip()
+        if op == "n" and page < pages - 1:
+            page += 1
+        elif op == "p" and page > 0:
+            page -= 1
+        elif op == "g" and arg.isdigit() and 1 <= int(arg) <= pages:
+            page = int(arg) - 1
+        elif op == "c" and arg.isdigit():
+            i = CUSTOMER_VIEW.locate(store, int(arg), sort, descending, where)
+            if i is None:
+                cli_warn(f"Customer {arg} is not in this view.")
+            else:
+                page = i // page_size
+        elif op == "s" and arg:
+            col, _, direction = arg.partition(" ")
+            if col not in VIEW_SORT_KEYS:
+                cli_error(f"Sort by one of: {', '.join(VIEW_SORT_KEYS)}")
+            else:
+                sort, descending, page = col, direction.strip().lower() == "desc", 0
+        elif op == "f":
+            try:
+                where, page = parse_view_filter(arg), 0
+            except ValueError as e:
+                cli_error(str(e))
+        elif op == "q":
+            break
+        else:
+            print("Invalid or no more pages.")
 
+@instrumented()
 def export_customers_csv(path: str):
-    """Export the main data file to a different CSV path (user-specified)."""
+    """Export the main data file to a different CSV path (user-specified); returns False on failure."""
     try:
-        df = load_data()
+        df = get_store().df
         df.to_csv(path, index=False)
         cli_info(f"Exported customers to {path}")
         append_audit("export_customers", path)
+        return True
     except Exception as e:
         cli_error(f"Export failed: {e}")
+        return False
+
+# =====================================================
+# PART 3: ADVANCED ADMIN FEATURES
+# Vishwanathan
+# =====================================================
+
+# Billing: every customer is billed on a tariff plan (see TariffPlans),
+# flat rate or slab-based, all in one NumPy pass over the frame.
+
+# Default slab example (can be updated via admin)
+DEFAULT_SLABS = [
+    {"upto": 30, "rate": 1.0},
+    {"upto": 60, "rate": 2.0},
+    {"upto": None, "rate": 3.0}
+]
+USE_SLABS = False  # mirrors the persisted default tariff plan ("slab" vs "flat"); see get_plans()
+
+def _round_cents(values: np.ndarray) -> np.ndarray:
+    """
+    Round to 2 decimals exactly like builtin round().
+    np.round scales by 100 first, which can disagree with round() on values
+    sitting right at a half cent; those few are re-rounded with round().
+    """
+    out = np.round(values, 2)
+    scaled = values * 100.0
+    frac = np.abs(scaled - np.floor(scaled) - 0.5)
+    near_half = np.flatnonzero(frac < 1e-6)
+    for i in near_half:
+        out[i] = round(float(values[i]), 2)
+    return out
+
+def _compile_slabs(slabs: List[Dict[str, float]]):
+    """
+    Turn a slab list into (caps, rates, open_rate) arrays.
+    caps/rates hold the bounded slabs in order; open_rate is the rate of the
+    'upto' None slab (or None when the table has no open-ended slab).
+    """
+    caps, rates = [], []
+    open_rate = None
+    for slab in slabs:
+        upto = slab.get("upto")
+        rate = float(slab.get("rate", 0.0))
+        if upto is None:
+            open_rate = rate
+            break
+        caps.append(max(upto, 0))
+        rates.append(rate)
+    return np.asarray(caps, dtype=float), np.asarray(rates, dtype=float), open_rate
+
+# -------------------------
+# Tariff plans
+# -------------------------
+# PLANS_FILE holds {"default_plan": id, "plans": {id: plan}}. A plan is
+#   {"kind": "flat", "rate": r}      r per unit; rate null = the customer's tariff_per_unit
+#   {"kind": "slab", "slabs": [...]} same slab list format as DEFAULT_SLABS
+# Customers bill under their plan_id column; blank or unknown IDs use the
+# default plan. Toggling slab billing switches the default between the
+# built-in "flat" and "slab" plans, and is now persisted.
+
+BUILTIN_PLANS = {
+    "flat": {"kind": "flat", "rate": None},
+    "slab": {"kind": "slab", "slabs": DEFAULT_SLABS},
+}
+
+def _check_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate one plan definition; returns it normalized."""
+    kind = plan.get("kind")
+    if kind == "flat":
+        rate = plan.get("rate")
+        return {"kind": "flat", "rate": None if rate is None else float(rate)}
+    if kind == "slab":
+        slabs = [{"upto": None if s.get("upto") is None else float(s["upto"]),
+                  "rate": float(s.get("rate", 0.0))} for s in plan.get("slabs", [])]
+        if not slabs:
+            raise ValueError("Slab plan needs at least one slab")
+        return {"kind": "slab", "slabs": slabs}
+    raise ValueError(f"Unknown plan kind: {kind!r}")
+
+class TariffPlans:
+    """
+    The plan table, compiled for billing: plan i is row i of padded arrays
+    (caps/rates per slab, open-ended rate, flat rate, flat flag), so a whole
+    frame is billed with one gather per slab column whatever the plan mix.
+    """
+
+    def __init__(self, plans: Optional[Dict[str, Any]] = None, default_plan: str = "flat"):
+        self.plans = {pid: _check_plan(p) for pid, p in (plans or BUILTIN_PLANS).items()}
+        for pid, p in BUILTIN_PLANS.items():
+            self.plans.setdefault(pid, _check_plan(p))
+        if default_plan not in self.plans:
+            raise ValueError(f"Unknown default plan: {default_plan}")
+        self.default_plan = default_plan
+        self._compile()
+
+    @classmethod
+    def load(cls, path: str = PLANS_FILE) -> "TariffPlans":
+        try:
+            with open(path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(raw.get("plans"), raw.get("default_plan", "flat"))
+
+    def save(self, path: str = PLANS_FILE) -> None:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"default_plan": self.default_plan, "plans": self.plans}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def set_plan(self, pid: str, plan: Dict[str, Any]) -> None:
+        self.plans[pid] = _check_plan(plan)
+        self._compile()
+
+    def set_default(self, pid: str) -> None:
+        if pid not in self.plans:
+            raise ValueError(f"Unknown plan: {pid}")
+        self.default_plan = pid
+        self._compile()
+
+    def _compile(self) -> None:
+        self.ids = pd.Index(list(self.plans))
+        width = max((len(_compile_slabs(p["slabs"])[0]) for p in self.plans.values() if p["kind"] == "slab"),
+                    default=0)
+        n = len(self.ids)
+        # padding slabs have cap 0: they take nothing once the first slab ran
+        self._caps = np.zeros((n, width))
+        self._rates = np.zeros((n, width))
+        self._open = np.zeros(n)
+        self._flat = np.zeros(n, dtype=bool)
+        self._flat_rate = np.full(n, np.nan)   # nan = use the customer's tariff_per_unit
+        for i, p in enumerate(self.plans.values()):
+            if p["kind"] == "flat":
+                self._flat[i] = True
+                if p["rate"] is not None:
+                    self._flat_rate[i] = p["rate"]
+                continue
+            caps, rates, open_rate = _compile_slabs(p["slabs"])
+            self._caps[i, :len(caps)] = caps
+            self._rates[i, :len(rates)] = rates
+            self._open[i] = 0.0 if open_rate is None else open_rate
+        self._default = self.ids.get_loc(self.default_plan)
+
+    def codes(self, plan_ids) -> np.ndarray:
+        """Plan row per customer; blank/unknown plan IDs map to the default plan."""
+        col = pd.Series(plan_ids)
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # look up each category once, then gather by the category codes
+            lut = np.append(self.ids.get_indexer(col.cat.categories.astype(str)), -1)
+            codes = lut[col.cat.codes.to_numpy()]
+        else:
+            codes = self.ids.get_indexer(col.astype(object).fillna("").astype(str))
+        return np.where(codes < 0, self._default, codes)
+
+    def bill(self, cons, tariff, plan_ids=None) -> np.ndarray:
+        """
+        Bill amounts for whole columns: consumption x rate on flat plans, the
+        slab table (rounded to the cent) on slab plans.
+        """
+        cons = np.asarray(cons, dtype=float)
+        tariff = np.asarray(tariff, dtype=float)
+        codes = (np.full(len(cons), self._default) if plan_ids is None else self.codes(plan_ids))
+        rate = self._flat_rate[codes]
+        flat = cons * np.where(np.isnan(rate), tariff, rate)
+        remaining = cons.copy()
+        total = np.zeros_like(remaining)
+        for j in range(self._caps.shape[1]):
+            take = np.minimum(remaining, self._caps[codes, j])
+            total += take * self._rates[codes, j]
+            remaining -= take
+        total += remaining * self._open[codes]
+        return _round_cents(np.where(self._flat[codes], flat, np.maximum(total, 0.0)))
+
+_PLANS: Optional[TariffPlans] = None
+
+def get_plans() -> TariffPlans:
+    """The tariff plan table, loaded from PLANS_FILE on first use."""
+    global _PLANS, USE_SLABS
+    if _PLANS is None:
+        _PLANS = TariffPlans.load()
+        USE_SLABS = _PLANS.default_plan == "slab"
+    return _PLANS
 
-# =====================================================
-# PART 3: ADVANCED ADMIN FEATURES
-# Vishwanathan
-# =====================================================
+def save_plans() -> None:
+    global USE_SLABS
+    plans = get_plans()
+    plans.save()
+    USE_SLABS = plans.default_plan == "slab"
+    CUSTOMER_VIEW.forget("plan_id")   # same plan IDs, new rates: bill orders are stale
+
+@instrumented()
+def bill_amounts(df: pd.DataFrame) -> pd.Series:
+    """bill_amount column for a customer frame, each customer on their tariff plan."""
+    cons = pd.to_numeric(df["consumption"], errors="coerce").to_numpy(dtype=float)
+    tariff = pd.to_numeric(df["tariff_per_unit"], errors="coerce").to_numpy(dtype=float)
+    plan_ids = df["plan_id"] if "plan_id" in df.columns else None
+    METRICS.note(rows=len(df))
+    return pd.Series(get_plans().bill(cons, tariff, plan_ids), index=df.index, name="bill_amount")
+
+# Single-mode helpers from before tariff plans; all go through TariffPlans.bill
+def calculate_bills_flat(cons: np.ndarray, tariff: np.ndarray) -> np.ndarray:
+    """consumption x tariff_per_unit, rounded to the cent (the built-in "flat" plan)."""
+    return TariffPlans(default_plan="flat").bill(cons, tariff)
+
+def calculate_bills_slabs(cons: np.ndarray, slabs: List[Dict[str, float]]) -> np.ndarray:
+    """Bills for a slab table (DEFAULT_SLABS format), rounded to the cent."""
+    cons = np.asarray(cons, dtype=float)
+    return TariffPlans({"slabs": {"kind": "slab", "slabs": slabs}}, "slabs").bill(cons, np.zeros(len(cons)))
+
+def calculate_bills(cons: np.ndarray, tariff: np.ndarray, use_slabs: Optional[bool] = None) -> np.ndarray:
+    """Bills on the default plan (use_slabs forces the built-in "slab" or "flat" plan)."""
+    if use_slabs is None:
+        return get_plans().bill(cons, tariff)
+    return TariffPlans(default_plan="slab" if use_slabs else "flat").bill(cons, tariff)
 
-# Billing calculation types: simple flat rate, or slab-based
 def calculate_bill_flat(cons: float, tariff: float) -> float:
-    return round(cons * tariff, 2)
+    return float(calculate_bills_flat([cons], [tariff])[0])
 
 def calculate_bill_slabs(cons: float, slabs: List[Dict[str, float]]) -> float:
     """
@@ -314,33 +2393,10 @@ def calculate_bill_slabs(cons: float, slabs: List[Dict[str, float]]) -> float:
     Example: slabs = [{'upto': 30, 'rate': 1.0}, {'upto': 60, 'rate': 2.0}, {'upto': None, 'rate': 3.0}]
     'upto' None indicates remaining
     """
-    remaining = cons
-    total = 0.0
-    for slab in slabs:
-        upto = slab.get("upto")
-        rate = float(slab.get("rate", 0.0))
-        if upto is None:
-            # remaining slab
-            total += remaining * rate
-            remaining = 0
-            break
-        take = min(remaining, max(upto, 0))
-        total += take * rate
-        remaining -= take
-        if remaining <= 0:
-            break
-    return round(max(total, 0.0), 2)
-
-# Default slab example (can be updated via admin)
-DEFAULT_SLABS = [
-    {"upto": 30, "rate": 1.0},
-    {"upto": 60, "rate": 2.0},
-    {"upto": None, "rate": 3.0}
-]
-USE_SLABS = False  # toggle between flat tariff_per_unit and slab billing
+    return float(calculate_bills_slabs([cons], slabs)[0])
 
 def calculate_bill_row(row: Any) -> float:
-    """Return bill amount depending on slab mode or flat tariff."""
+    """Bill amount of one customer record on its tariff plan."""
     try:
         cons = float(row.get("consumption", 0.0))
     except Exception:
@@ -349,81 +2405,467 @@ def calculate_bill_row(row: Any) -> float:
         tariff = float(row.get("tariff_per_unit", 1.0))
     except Exception:
         tariff = 1.0
-    if USE_SLABS:
-        return calculate_bill_slabs(cons, DEFAULT_SLABS)
-    else:
-        return calculate_bill_flat(cons, tariff)
+    return float(get_plans().bill([cons], [tariff], [row.get("plan_id") or ""])[0])
+
+# -------------------------
+# Analytics helpers
+# -------------------------
+# Partial selection instead of full sorts: np.argpartition / np.partition
+# cost O(n), then only the selected handful is ordered.
+
+def top_k(values, k: int) -> np.ndarray:
+    """
+    Positions of the k largest finite values, largest first; ties keep
+    their original order. NaN never makes the list.
+    """
+    v = np.asarray(values, dtype=float)
+    pos = np.flatnonzero(np.isfinite(v))
+    if k <= 0 or not len(pos):
+        return np.zeros(0, dtype=np.int64)
+    if k < len(pos):
+        # the k-th largest value; every value above it is in, ties are resolved by position
+        kth = np.partition(v[pos], len(pos) - k)[len(pos) - k]
+        above = pos[v[pos] > kth]
+        ties = pos[v[pos] == kth][:k - len(above)]
+        pos = np.concatenate([above, ties])
+    return pos[np.lexsort((pos, -v[pos]))]
+
+def _quantile_ranks(n, qs):
+    """
+    Order statistics (lo, hi) and weight for quantiles qs of n values, as
+    np.nanpercentile's linear interpolation: v[lo] + (v[hi] - v[lo]) * w.
+    n may be an array (one row of ranks per count).
+    """
+    ranks = np.multiply.outer(np.asarray(n, dtype=float) - 1, np.asarray(qs, dtype=float))
+    lo = np.floor(ranks).astype(np.int64)
+    return lo, np.ceil(ranks).astype(np.int64), ranks - lo
+
+def quantiles(values, qs) -> List[float]:
+    """
+    Several quantiles (fractions 0..1) from one np.partition call; same
+    linear interpolation as np.nanpercentile, NaN ignored, nan when empty.
+    """
+    v = np.asarray(values, dtype=float)
+    v = v[np.isfinite(v)]
+    if not len(v):
+        return [float("nan")] * len(qs)
+    lo, hi, w = _quantile_ranks(len(v), qs)
+    part = np.partition(v, np.unique(np.concatenate([lo, hi])))
+    return (part[lo] + (part[hi] - part[lo]) * w).tolist()
+
+def grouped_top_k(df: pd.DataFrame, by: str, col: str, k: int) -> pd.DataFrame:
+    """
+    The k largest rows of col within each group of by, groups in sorted
+    order and largest first inside a group. Only the selected rows are sorted.
+    """
+    vals = pd.to_numeric(df[col], errors="coerce")
+    rank = vals.groupby(df[by], observed=True, sort=False).rank(method="first", ascending=False)
+    picked = df[(rank <= k).to_numpy()]
+    return picked.assign(_v=vals[picked.index]).sort_values([by, "_v"], ascending=[True, False],
+                                                              kind="stable").drop(columns="_v")
+
+def grouped_quantiles(df: pd.DataFrame, by: str, col: str, qs) -> pd.DataFrame:
+    """
+    Rows per group of by, one column per quantile of col (e.g. p50, p90).
+    Sorting by value, then stably by group, lays every group out in order;
+    the ranks and interpolation are those of quantiles(), gathered for all
+    groups at once.
+    """
+    codes, groups = pd.factorize(df[by], sort=True)
+    vals = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+    keep = (codes >= 0) & np.isfinite(vals)
+    codes, vals = codes[keep], vals[keep]
+    order = np.argsort(vals)
+    # then stably by group: small integer codes take numpy's radix sort
+    order = order[np.argsort(codes[order].astype(np.min_scalar_type(len(groups))), kind="stable")]
+    v = vals[order]
+    counts = np.bincount(codes, minlength=len(groups))
+    start = (np.cumsum(counts) - counts)[:, None]
+    lo, hi, w = _quantile_ranks(counts, qs)
+    has = counts[:, None] > 0
+    lo, hi = np.where(has, start + lo, 0), np.where(has, start + hi, 0)
+    res = np.where(has, v[lo] + (v[hi] - v[lo]) * w, np.nan) if len(v) else np.full(lo.shape, np.nan)
+    return pd.DataFrame(res, index=pd.Index(groups, name=by), columns=[f"p{round(q * 100):d}" for q in qs])
+
+# -------------------------
+# Consumption statistics
+# -------------------------
+STATS_TOP_K = 10                # consumers listed by summary_report
+STATS_RELATIVE_ERROR = 0.01     # quantile sketch: reported value within +/-1% of the true one
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch (DDSketch): value v goes to bucket
+    ceil(log_gamma(|v|)), gamma = (1+e)/(1-e), so any quantile is answered
+    within relative error e. Unlike t-digest/KLL it supports removal, which
+    edits and deletes need, and two sketches merge by adding bucket counts.
+    """
+
+    def __init__(self, rel_error: float = STATS_RELATIVE_ERROR):
+        self.rel_error = rel_error
+        self.gamma = (1 + rel_error) / (1 - rel_error)
+        self._log_gamma = np.log(self.gamma)
+        self.pos: Dict[int, int] = {}
+        self.neg: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _apply(self, values, sign: int) -> None:
+        v = np.asarray(values, dtype=float)
+        v = v[np.isfinite(v)]
+        self.count += sign * len(v)
+        self.zeros += sign * int((v == 0).sum())
+        for side, part in ((self.pos, v[v > 0]), (self.neg, -v[v < 0])):
+            keys, counts = np.unique(np.ceil(np.log(part) / self._log_gamma).astype(np.int64),
+                                     return_counts=True)
+            for k, c in zip(keys.tolist(), counts.tolist()):
+                n = side.get(k, 0) + sign * c
+                if n:
+                    side[k] = n
+                else:
+                    side.pop(k, None)
+
+    def add(self, values) -> None:
+        self._apply(values, 1)
+
+    def remove(self, values) -> None:
+        self._apply(values, -1)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different error settings")
+        for side, theirs in ((self.pos, other.pos), (self.neg, other.neg)):
+            for k, c in theirs.items():
+                side[k] = side.get(k, 0) + c
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantiles(self, qs) -> List[float]:
+        """Values at fractions qs (0..1) of the distribution; nan when empty."""
+        if self.count <= 0:
+            return [float("nan")] * len(qs)
+        # buckets in ascending value order: negatives (largest |v| first), zero, positives
+        nk = sorted(self.neg, reverse=True)
+        pk = sorted(self.pos)
+        reps = np.concatenate([
+            -2 * self.gamma ** np.asarray(nk, dtype=float) / (self.gamma + 1),
+            [0.0],
+            2 * self.gamma ** np.asarray(pk, dtype=float) / (self.gamma + 1),
+        ])
+        counts = np.concatenate([[self.neg[k] for k in nk], [self.zeros], [self.pos[k] for k in pk]])
+        cum = np.cumsum(counts)
+        # interpolate between neighbouring ranks like np.percentile's default
+        ranks = np.asarray(qs, dtype=float) * (self.count - 1)
+        lo = reps[np.searchsorted(cum, np.floor(ranks), side="right")]
+        hi = reps[np.searchsorted(cum, np.ceil(ranks), side="right")]
+        frac = ranks - np.floor(ranks)
+        return (lo + (hi - lo) * frac).tolist()
+
+class ConsumptionStats:
+    """
+    Running total/count, a top-K reserve and a QuantileSketch of the
+    consumption column, kept current from DataStore events so
+    summary_report does not rescan the table. Built on first use after a
+    (re)load.
+
+    Top-K: `_top` holds every customer above `_floor` (and possibly some
+    equal to it), so its K largest are the table's K largest. When it runs
+    short it is refilled from the frame; when it grows past 8K it is cut
+    back to 4K and the floor raised.
+    """
+
+    def __init__(self, k: int = STATS_TOP_K, rel_error: float = STATS_RELATIVE_ERROR):
+        self.k = k
+        self.rel_error = rel_error
+        self.built = False
+
+    @instrumented("stats_build")
+    def build(self, df: pd.DataFrame) -> None:
+        cons = pd.to_numeric(df["consumption"], errors="coerce").to_numpy(dtype=float)
+        finite = np.isfinite(cons)
+        self.total = float(cons[finite].sum())
+        self.count = int(finite.sum())
+        self.sketch = QuantileSketch(self.rel_error)
+        self.sketch.add(cons)
+        self._fill_top(df["customer_id"].to_numpy()[finite], cons[finite])
+        self.built = True
+
+    def _fill_top(self, cids: np.ndarray, cons: np.ndarray) -> None:
+        keep = min(4 * self.k, len(cons))
+        part = top_k(cons, keep)
+        self._top = dict(zip(cids[part].tolist(), cons[part].tolist()))
+        # everything left out is <= the floor; a full table means nothing was left out
+        self._floor = min(self._top.values()) if keep < len(cons) else -np.inf
+
+    def _track(self, cid: int, value: float) -> None:
+        if np.isfinite(value) and value >= self._floor:
+            self._top[cid] = value
+            if len(self._top) > 8 * self.k:
+                kept = sorted(self._top.items(), key=lambda kv: kv[1], reverse=True)[:4 * self.k]
+                self._top = dict(kept)
+                self._floor = kept[-1][1]
+        else:
+            self._top.pop(cid, None)
+            if len(self._top) < self.k and self._floor > -np.inf:
+                self.built = False   # reserve exhausted: rescan on next read
+
+    def _shift(self, values, sign: int) -> None:
+        v = np.asarray(values, dtype=float)
+        v = v[np.isfinite(v)]
+        self.total += sign * float(v.sum())
+        self.count += sign * len(v)
+        if sign > 0:
+            self.sketch.add(v)
+        else:
+            self.sketch.remove(v)
+
+    # store callbacks
+    def reset(self, store: "DataStore") -> None:
+        self.built = False
 
-def summary_report(detailed: bool = False):
+    def added(self, store: "DataStore", new: pd.DataFrame) -> None:
+        if not self.built:
+            return
+        cons = pd.to_numeric(new["consumption"], errors="coerce").to_numpy(dtype=float)
+        self._shift(cons, 1)
+        for cid, value in zip(new["customer_id"].tolist(), cons.tolist()):
+            self._track(int(cid), value)
+
+    def updated(self, store: "DataStore", old: pd.DataFrame) -> None:
+        if not self.built or "consumption" not in old.columns:
+            return
+        cids = old.index.to_numpy()
+        labels = [store.position(int(c)) for c in cids]
+        cur = pd.to_numeric(store.df.loc[labels, "consumption"], errors="coerce").to_numpy(dtype=float)
+        self._shift(pd.to_numeric(old["consumption"], errors="coerce"), -1)
+        self._shift(cur, 1)
+        for cid, value in zip(cids.tolist(), cur.tolist()):
+            if not self.built:
+                break
+            self._track(int(cid), value)
+
+    def deleted(self, store: "DataStore", old: pd.DataFrame) -> None:
+        if not self.built:
+            return
+        self._shift(pd.to_numeric(old["consumption"], errors="coerce"), -1)
+        for cid in old.index.tolist():
+            self._track(int(cid), float("nan"))
+
+    def snapshot(self, store: "DataStore", exact: bool = False) -> Dict[str, Any]:
+        """
+        total, average, p50, p90, highest and top (customer_id, consumption)
+        pairs. exact=True recomputes everything from the frame (for audits);
+        otherwise p50/p90 carry the sketch's relative error.
+        """
+        df = store.df
+        if exact:
+            cons = df["consumption"].astype(float).to_numpy()
+            order = top_k(cons, self.k)
+            have = len(order) > 0
+            p50, p90 = quantiles(cons, [0.5, 0.9]) if have else (0.0, 0.0)
+            return {
+                "total": float(np.nansum(cons)),
+                "average": float(np.nanmean(cons)) if have else 0.0,
+                "p50": p50, "p90": p90,
+                "highest": float(cons[order[0]]) if have else 0.0,
+                "top": list(zip(df["customer_id"].to_numpy()[order].tolist(), cons[order].tolist())),
+            }
+        if not self.built:
+            self.build(df)
+        top = sorted(self._top.items(), key=lambda kv: (-kv[1], store.position(kv[0])))[:self.k]
+        p50, p90 = self.sketch.quantiles([0.5, 0.9]) if self.count else (0.0, 0.0)
+        return {
+            "total": self.total,
+            "average": self.total / self.count if self.count else 0.0,
+            "p50": p50, "p90": p90,
+            "highest": top[0][1] if top else 0.0,
+            "top": top,
+        }
+
+CONSUMPTION_STATS = ConsumptionStats()
+
+def consumption_stats(exact: bool = False) -> Dict[str, Any]:
+    """Summary statistics of the consumption column; see ConsumptionStats.snapshot."""
+    store = get_store()
+    store.subscribe(CONSUMPTION_STATS)
+    return CONSUMPTION_STATS.snapshot(store, exact=exact)
+
+@instrumented()
+def summary_report(detailed: bool = False, exact: bool = False):
     """Show statistics and optionally export summary CSV."""
-    df = load_data()
+    df = get_store().df
     if df.empty:
         cli_warn("No data for summary.")
         return
-    cons = df["consumption"].astype(float).to_numpy()
-    total = float(np.nansum(cons))
-    avg = float(np.nanmean(cons)) if len(cons) else 0.0
-    highest = float(np.nanmax(cons)) if len(cons) else 0.0
-    p50 = float(np.nanpercentile(cons, 50)) if len(cons) else 0.0
-    p90 = float(np.nanpercentile(cons, 90)) if len(cons) else 0.0
-
-    print("\n--- SUMMARY ---")
-    print(f"Total consumption : {total:.2f} units")
-    print(f"Average consumption : {avg:.2f} units")
-    print(f"Median consumption : {p50:.2f} units")
-    print(f"90th percentile : {p90:.2f} units")
-    print(f"Highest consumption : {highest:.2f} units")
+    stats = consumption_stats(exact=exact)
+    store = get_store()
+
+    print("\n--- SUMMARY ---" + ("" if exact else f" (percentiles within {STATS_RELATIVE_ERROR:.0%})"))
+    print(f"Total consumption : {stats['total']:.2f} units")
+    print(f"Average consumption : {stats['average']:.2f} units")
+    print(f"Median consumption : {stats['p50']:.2f} units")
+    print(f"90th percentile : {stats['p90']:.2f} units")
+    print(f"Highest consumption : {stats['highest']:.2f} units")
     # Top consumers table
-    top = df.sort_values("consumption", ascending=False).head(10)[["customer_id", "name", "consumption"]]
-    print("\nTop 10 consumers:")
+    top_ids = [cid for cid, _ in stats["top"]]
+    top = df.loc[[store.position(cid) for cid in top_ids], ["customer_id", "name", "consumption"]]
+    print(f"\nTop {len(top)} consumers:")
     print(top.to_string(index=False))
 
     if detailed:
         # Create a CSV summary with basic stats per-customer
         out = df.copy()
-        out["bill_amount"] = out.apply(lambda r: calculate_bill_row(r), axis=1)
+        out["bill_amount"] = bill_amounts(out)
         out_summary = out[["customer_id", "name", "consumption", "tariff_per_unit", "bill_amount"]]
         out_summary.to_csv(SUMMARY_FILE, index=False)
         cli_info(f"Detailed summary exported to {SUMMARY_FILE}")
         append_audit("summary_export", SUMMARY_FILE)
 
-def export_bills():
-    """Produce bills_export.csv (snapshot) containing bill_amount for each customer."""
-    df = load_data()
+AREA_TOP_K = 3  # top consumers listed per address in area_report
+
+@instrumented()
+def area_report():
+    """Per-address consumption totals, percentiles and top consumers."""
+    df = get_store().df
     if df.empty:
-        warn("No data to export bills.")
+        cli_warn("No data for area report.")
+        return
+    cons = pd.to_numeric(df["consumption"], errors="coerce")
+    areas = cons.groupby(df["address"], observed=True).agg(customers="size", total="sum", average="mean")
+    areas = areas.join(grouped_quantiles(df, "address", "consumption", [0.5, 0.9]))
+    print("\n--- CONSUMPTION BY AREA ---")
+    print(areas.round(2).to_string())
+    top = grouped_top_k(df, "address", "consumption", AREA_TOP_K)
+    print(f"\nTop {AREA_TOP_K} consumers per area:")
+    print(top[["address", "customer_id", "name", "consumption"]].to_string(index=False))
+
+HISTORY_ROLLING_WINDOW = 3  # periods averaged by reading_history
+
+@instrumented()
+def reading_history():
+    """Show one customer's readings per period with a rolling average."""
+    store = get_store()
+    cid = read_int("Customer ID: ")
+    if cid not in store:
+        cli_error("Customer not found.")
         return
-    out = df.copy()
-    out["bill_amount"] = out.apply(lambda r: calculate_bill_row(r), axis=1)
-    # last_generated marker kept empty as date strings are optional
-    out["bill_generated_on"] = ""
-    out.to_csv(BILLS_FILE, index=False)
-    cli_info(f"Bills exported to {BILLS_FILE}")
-    append_audit("export_bills", BILLS_FILE)
+    hist = READINGS.customer_history(cid)
+    if hist.empty:
+        cli_info("No readings recorded yet for this customer.")
+        return
+    hist["rolling_avg"] = hist["consumption"].rolling(HISTORY_ROLLING_WINDOW, min_periods=1).mean()
+    print(hist.round(2).to_string(index=False))
+
+def _format_chunk(args) -> str:
+    """CSV text of one chunk (runs in pool workers, so module-level)."""
+    chunk, header = args
+    return chunk.to_csv(index=False, header=header)
+
+def _bill_chunks(df: pd.DataFrame, start: int, stop: int, chunk_rows: int):
+    """(chunk with bill columns, header flag) for rows start..stop of df."""
+    for lo in range(start, stop, chunk_rows):
+        chunk = df.iloc[lo:min(lo + chunk_rows, stop)].drop(columns=INTERNAL_COLUMNS)
+        chunk["bill_amount"] = bill_amounts(chunk)
+        # last_generated marker kept empty as date strings are optional
+        chunk["bill_generated_on"] = ""
+        yield chunk, lo == start
+
+def _write_stream(path: str, texts) -> None:
+    """Write text pieces to path.tmp, fsync and rename (see atomic_write)."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        for text in texts:
+            f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+        if METRICS.active:
+            METRICS.note(bytes_written=os.fstat(f.fileno()).st_size)
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+def _formatted(jobs, pool: Optional[ProcessPoolExecutor], window: int):
+    """Format jobs in order; with a pool, keep at most window chunks in flight."""
+    if pool is None:
+        for job in jobs:
+            yield _format_chunk(job)
+        return
+    pending = []
+    for job in jobs:
+        pending.append(pool.submit(_format_chunk, job))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for fut in pending:
+        yield fut.result()
+
+def shard_path(path: str, shard: int, shards: int) -> str:
+    """bills_export.csv -> bills_export_001.csv ... when exporting in shards."""
+    if shards <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{shard + 1:03d}{ext}"
+
+@instrumented()
+def export_bills(path: str = BILLS_FILE, shards: Optional[int] = None,
+                 workers: Optional[int] = None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> List[str]:
+    """
+    Produce bills_export.csv (snapshot) containing bill_amount for each customer.
+    Streams EXPORT_CHUNK_ROWS customers at a time instead of copying the
+    whole table; workers > 0 formats chunks in a process pool (order kept);
+    shards > 1 splits customers, in table order, over that many files each
+    with its own header. Returns the files written.
+    """
+    df = get_store().df
+    if df.empty:
+        cli_warn("No data to export bills.")
+        return []
+    shards = max(1, EXPORT_SHARDS if shards is None else shards)
+    if workers is None:
+        workers = EXPORT_WORKERS or (SHARDS.workers(len(SHARDS.manifest()["files"]), len(df))
+                                     if SHARDS.exists() else 0)
+    bounds = np.linspace(0, len(df), min(shards, len(df)) + 1).astype(int)
+    paths = [shard_path(path, i, len(bounds) - 1) for i in range(len(bounds) - 1)]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    try:
+        for out_path, start, stop in zip(paths, bounds[:-1], bounds[1:]):
+            jobs = _bill_chunks(df, int(start), int(stop), chunk_rows)
+            _write_stream(out_path, _formatted(jobs, pool, 2 * max(workers, 1)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if len(paths) == 1:
+        cli_info(f"Bills exported to {paths[0]}")
+    else:
+        cli_info(f"Bills exported to {len(paths)} files: {paths[0]} .. {paths[-1]}")
+    append_audit("export_bills", ", ".join(paths))
+    return paths
 
 def update_tariff_single(cid: int, new_tariff: float):
     """Helper to update tariff for a single customer programmatically."""
-    df = load_data()
-    if cid not in df["customer_id"].values:
+    store = get_store()
+    if cid not in store:
         raise ValueError("Customer ID not found")
-    df.loc[df["customer_id"] == cid, "tariff_per_unit"] = float(new_tariff)
-    save_data(df)
+    store.update(cid, {"tariff_per_unit": float(new_tariff)})
     append_audit("update_tariff_single", f"id={cid}, tariff={new_tariff}")
 
+@instrumented()
 def update_tariff():
-    """Admin interactive tariff update: single or bulk."""
-    df = load_data()
+    """Admin interactive tariff update: single or bulk, and tariff plans."""
+    store = get_store()
+    plans = get_plans()
+    df = store.df
     if df.empty:
         cli_warn("No data for tariff update.")
         return
     print("1) Update single customer tariff")
     print("2) Update tariffs by filter (e.g., consumption > X)")
     print("3) Set global tariff")
-    print("4) Toggle slab billing (current: {})".format("ON" if USE_SLABS else "OFF"))
+    print("4) Toggle slab billing (current: {})".format("ON" if plans.default_plan == "slab" else "OFF"))
+    print("5) Assign tariff plan to customer")
+    print("6) List / define tariff plans")
     ch = input("Choice: ").strip()
     if ch == "1":
         cid = read_int("Customer ID: ")
-        if cid not in df["customer_id"].values:
+        if cid not in store:
             cli_error("Customer not found.")
             return
         new_tariff = read_float("New tariff per unit: ")
@@ -438,56 +2880,351 @@ def update_tariff():
         if matched.empty:
             cli_warn("No customers matched that filter.")
             return
-        df.loc[mask, "tariff_per_unit"] = float(new_tariff)
-        save_data(df)
+        store.update_where(mask, {"tariff_per_unit": float(new_tariff)})
         append_audit("bulk_tariff_update", f"thr={thresh}, tariff={new_tariff}, matched={len(matched)}")
         cli_info(f"Updated tariff for {len(matched)} customers.")
     elif ch == "3":
         new_tariff = read_float("Enter global tariff per unit: ")
-        df["tariff_per_unit"] = float(new_tariff)
-        save_data(df) 
+        store.update_where(slice(None), {"tariff_per_unit": float(new_tariff)})
         append_audit("global_tariff_update", f"{new_tariff}")
         cli_info("Global tariff updated.")
     elif ch == "4":
-        # Toggle slab billing mode
-        global USE_SLABS
-        USE_SLABS = not USE_SLABS
-        cli_info(f"Slab billing toggled to {'ON' if USE_SLABS else 'OFF'}")
-        append_audit("toggle_slab", f"{USE_SLABS}")
+        # Toggle slab billing mode: the default plan for customers without one
+        plans.set_default("flat" if plans.default_plan == "slab" else "slab")
+        save_plans()
+        slabs_on = plans.default_plan == "slab"
+        cli_info(f"Slab billing toggled to {'ON' if slabs_on else 'OFF'}")
+        append_audit("toggle_slab", f"{slabs_on}")
+    elif ch == "5":
+        cid = read_int("Customer ID: ")
+        if cid not in store:
+            cli_error("Customer not found.")
+            return
+        pid = input(f"Plan ID ({', '.join(plans.ids)}; blank = default): ").strip()
+        if pid and pid not in plans.plans:
+            cli_error("Unknown plan.")
+            return
+        store.update(cid, {"plan_id": pid})
+        append_audit("assign_plan", f"id={cid}, plan={pid or 'default'}")
+        cli_info(f"Customer {cid} now on plan {pid or plans.default_plan + ' (default)'}")
+    elif ch == "6":
+        define_plan(plans)
     else:
         cli_error("Invalid option.")
 
+def _parse_slabs(text: str) -> List[Dict[str, Any]]:
+    """'30:1.0, 60:2.0, *:3.0' -> slab list ('*' = the open-ended slab)."""
+    slabs = []
+    for part in text.split(","):
+        upto, _, rate = part.strip().partition(":")
+        slabs.append({"upto": None if upto.strip() == "*" else float(upto), "rate": float(rate)})
+    return slabs
+
+def define_plan(plans: TariffPlans):
+    """Show the plan table and optionally add or replace a plan."""
+    for pid, plan in plans.plans.items():
+        mark = " (default)" if pid == plans.default_plan else ""
+        if plan["kind"] == "flat":
+            rate = "customer tariff" if plan["rate"] is None else f"{plan['rate']}/unit"
+            print(f"  {pid}{mark}: flat, {rate}")
+        else:
+            slabs = ", ".join(f"{'*' if s['upto'] is None else s['upto']}:{s['rate']}" for s in plan["slabs"])
+            print(f"  {pid}{mark}: slab, {slabs}")
+    pid = input("Plan ID to add/replace (blank to go back): ").strip()
+    if not pid:
+        return
+    kind = input("Kind (flat/slab): ").strip().lower()
+    try:
+        if kind == "flat":
+            rate = input("Rate per unit (blank = customer's own tariff): ").strip()
+            plan = {"kind": "flat", "rate": float(rate) if rate else None}
+        else:
+            spec = input("Slabs as upto:rate pairs, '*' for the rest (e.g. 30:1.0,60:2.0,*:3.0): ")
+            plan = {"kind": "slab", "slabs": _parse_slabs(spec)}
+        plans.set_plan(pid, plan)
+    except ValueError as e:
+        cli_error(f"Invalid plan: {e}")
+        return
+    save_plans()
+    append_audit("define_plan", f"{pid}={json.dumps(plans.plans[pid])}")
+    cli_info(f"Plan {pid} saved to {PLANS_FILE}")
+
+@instrumented()
 def mark_paid():
-    df = load_data()
+    store = get_store()
+    df = store.df
     if df.empty:
         cli_warn("No data.")
         return
     cid = read_int("Enter customer ID to mark as paid: ")
-    if cid not in df["customer_id"].values:
+    if cid not in store:
         cli_error("Customer not found.")
         return
-    df.loc[df["customer_id"] == cid, "paid"] = True
-    df.loc[df["customer_id"] == cid, "paid_date"] = ""  # no datetime; can be filled manually
-    save_data(df)
+    # settles the current bill and any arrears; no datetime, paid_date can be filled manually
+    store.update(cid, {"paid": True, "paid_date": "", "arrears": 0.0, "overdue_periods": 0})
     append_audit("mark_paid", f"id={cid}")
     cli_info(f"Customer {cid} marked as PAID")
 
+# -------------------------
+# Overdue and aging
+# -------------------------
+
+def roll_arrears(rows: pd.DataFrame, new_period) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    arrears and overdue_periods for rows about to get a new bill. Where the
+    reading opens a new period (new_period) and the account is unpaid,
+    the current bill joins the arrears, PENALTY_RATE is charged on the
+    total and the account ages one period. Paid accounts are unchanged.
+    """
+    arrears = rows["arrears"].to_numpy(dtype=float)
+    aged = rows["overdue_periods"].to_numpy(dtype=np.int64)
+    owed = arrears + np.maximum(bill_amounts(rows).to_numpy(), 0.0)
+    roll = np.asarray(new_period, dtype=bool) & ~rows["paid"].to_numpy(dtype=bool) & (owed > 0)
+    arrears = np.where(roll, _round_cents(owed * (1 + PENALTY_RATE)), arrears)
+    return arrears, np.where(roll, aged + 1, aged)
+
+def _is_unpaid(rows: pd.DataFrame) -> np.ndarray:
+    """OVERDUE_CRITERIA: unpaid with consumption, or carrying arrears."""
+    return ~rows["paid"].to_numpy(dtype=bool) & (
+        (rows["consumption"].to_numpy(dtype=float) > 0) | (rows["arrears"].to_numpy(dtype=float) > 0))
+
+class UnpaidIndex:
+    """
+    customer_ids of accounts that owe money, kept current from DataStore
+    events (mark_paid, reading updates, adds, deletes), so the overdue list
+    only touches those rows. Rebuilt with one mask after a (re)load.
+    """
+
+    def __init__(self):
+        self.built = False
+        self.ids: set = set()
+
+    @instrumented("unpaid_index_build")
+    def build(self, df: pd.DataFrame) -> None:
+        self.ids = set(df["customer_id"].to_numpy()[_is_unpaid(df)].tolist())
+        self.built = True
+
+    def _refresh(self, rows: pd.DataFrame) -> None:
+        owing = _is_unpaid(rows)
+        cids = rows["customer_id"].tolist()
+        self.ids.difference_update(c for c, o in zip(cids, owing) if not o)
+        self.ids.update(c for c, o in zip(cids, owing) if o)
+
+    # store callbacks
+    def reset(self, store: "DataStore") -> None:
+        self.built = False
+
+    def added(self, store: "DataStore", new: pd.DataFrame) -> None:
+        if self.built:
+            self._refresh(new)
+
+    def updated(self, store: "DataStore", old: pd.DataFrame) -> None:
+        if self.built and old.columns.intersection(["paid", "consumption", "arrears"]).size:
+            self._refresh(store.df.loc[[store.position(int(c)) for c in old.index]])
+
+    def deleted(self, store: "DataStore", old: pd.DataFrame) -> None:
+        if self.built:
+            self.ids.difference_update(int(c) for c in old.index)
+
+UNPAID = UnpaidIndex()
+
+def overdue_accounts() -> pd.DataFrame:
+    """
+    Accounts that owe money with bill_amount, arrears, outstanding balance,
+    aging bucket and the penalty the next unpaid period would add.
+    """
+    store = get_store()
+    store.subscribe(UNPAID)
+    if not UNPAID.built:
+        UNPAID.build(store.df)
+    labels = sorted(store.position(c) for c in UNPAID.ids)
+    out = store.df.loc[labels, ["customer_id", "name", "phone", "consumption", "arrears",
+                                "overdue_periods", "paid", "tariff_per_unit", "plan_id"]].copy()
+    out["bill_amount"] = bill_amounts(out)
+    out["outstanding"] = _round_cents(out["arrears"].to_numpy() + out["bill_amount"].to_numpy())
+    out["aging"] = pd.Categorical.from_codes(
+        np.minimum(out["overdue_periods"].to_numpy(dtype=np.int64), len(AGING_BUCKETS) - 1),
+        categories=AGING_BUCKETS)
+    out["next_penalty"] = _round_cents(np.maximum(out["outstanding"].to_numpy(), 0.0) * PENALTY_RATE)
+    return out
+
+@instrumented()
 def list_overdue():
-    """Simplified overdue: unpaid AND consumption > 0"""
-    df = load_data()
-    if df.empty:
+    """Accounts owing money (unpaid with consumption, or in arrears), with aging."""
+    if get_store().df.empty:
         cli_warn("No data.")
         return
-    mask = (df["paid"] == False) & (df["consumption"].astype(float) > 0)
-    overdue = df[mask]
+    overdue = overdue_accounts()
     if overdue.empty:
         cli_info("No overdue accounts.")
         return
-    overdue["bill_amount"] = overdue.apply(lambda r: calculate_bill_row(r), axis=1)
-    pretty_print_df(overdue[["customer_id", "name", "phone", "consumption", "bill_amount"]])
+    pretty_print_df(overdue[["customer_id", "name", "phone", "consumption", "bill_amount",
+                             "arrears", "outstanding", "aging"]])
+    aging = overdue.groupby("aging", observed=False)["outstanding"].agg(["count", "sum"])
+    print("\nAging (periods overdue):")
+    print(aging.round(2).to_string())
+
+# -------------------------
+# Search index
+# -------------------------
+SEARCH_RESULT_LIMIT = 25      # rows shown per search in the admin menu
+SEARCH_REBUILD_AFTER = 50_000 # incremental name/phone edits before a full rebuild
+SEARCH_SCAN_FRACTION = 0.3    # scan instead when a query's rarest trigram is in more of the rows
+
+def _gram_codes(texts) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every trigram of every string as an int64 (three 21-bit code points),
+    plus the index of the string it came from.
+    """
+    texts = list(texts)
+    lens = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    cp = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    per = np.maximum(lens - 2, 0)
+    owner = np.repeat(np.arange(len(texts)), per)
+    pos = np.arange(len(owner)) - np.repeat(np.cumsum(per) - per, per) + np.repeat(np.cumsum(lens) - lens, per)
+    return (cp[pos] << 42) | (cp[pos + 1] << 21) | cp[pos + 2], owner
+
+class SearchIndex:
+    """
+    Substring search over name (case-insensitive) and phone.
+    One trigram index over both: sorted trigram codes, each with a sorted
+    run of customer_id postings. A query's trigrams are intersected and the
+    few candidates checked with a real substring test. Queries shorter than
+    three characters, or whose rarest trigram is in more than
+    SEARCH_SCAN_FRACTION of the rows, are cheaper as a plain scan.
+    Built on the first query after the store (re)loads; later adds and
+    name/phone edits go to a small side table until SEARCH_REBUILD_AFTER.
+    Stale postings are harmless since candidates are always verified.
+    """
+
+    def __init__(self):
+        self.built = False
+        self._codes = np.zeros(0, dtype=np.int64)
+        self._bounds = np.zeros(1, dtype=np.int64)
+        self._post = np.zeros(0, dtype=np.uint32)
+        self._extra: Dict[int, set] = {}
+        self._noted = 0
+
+    # store callbacks
+    def reset(self, store: "DataStore") -> None:
+        self.built = False
+
+    def added(self, store: "DataStore", new: pd.DataFrame) -> None:
+        if self.built:
+            self._note(new["customer_id"], new["name"], new["phone"])
+
+    def updated(self, store: "DataStore", old: pd.DataFrame) -> None:
+        if self.built and ("name" in old.columns or "phone" in old.columns):
+            cur = store.df.loc[store.positions(old.index).to_numpy(dtype=np.int64)]
+            self._note(cur["customer_id"], cur["name"], cur["phone"])
+
+    @staticmethod
+    def _texts(names: pd.Series, phones: pd.Series) -> List[str]:
+        return (names.astype(object).fillna("").astype(str).str.lower().tolist()
+                + phones.astype(object).fillna("").astype(str).tolist())
+
+    def _note(self, cids, names, phones) -> None:
+        cids = cids.to_numpy(dtype=np.int64)
+        codes, owner = _gram_codes(self._texts(names, phones))
+        for code, cid in zip(codes.tolist(), np.concatenate([cids, cids])[owner].tolist()):
+            self._extra.setdefault(code, set()).add(cid)
+        self._noted += len(cids)
+        if self._noted > SEARCH_REBUILD_AFTER:
+            self.built = False
+
+    @instrumented("search_index_build")
+    def build(self, df: pd.DataFrame) -> None:
+        ids = df["customer_id"].to_numpy(dtype=np.int64)
+        codes, owner = _gram_codes(self._texts(df["name"], df["phone"]))
+        gid = np.concatenate([ids, ids])[owner]
+        slot, uniques = pd.factorize(codes, sort=True)
+        if len(ids) and ids.max() < 2 ** 32 and len(uniques) < 2 ** 31:
+            # (slot, id) packed in one int64: a single sort, duplicates dropped
+            key = np.sort((slot.astype(np.int64) << 32) | gid)
+            key = key[np.r_[True, key[1:] != key[:-1]]] if len(key) else key
+            slot, gid = key >> 32, key & 0xFFFFFFFF
+        else:
+            order = np.lexsort((gid, slot))
+            slot, gid = slot[order], gid[order]
+        self._codes = np.asarray(uniques, dtype=np.int64)
+        self._bounds = np.searchsorted(slot, np.arange(len(uniques) + 1))
+        self._post = gid.astype(np.uint32) if len(gid) and gid.max() < 2 ** 32 else gid
+        self._extra.clear()
+        self._noted = 0
+        self.built = True
+
+    def _candidates(self, q: str, n_rows: int) -> Optional[np.ndarray]:
+        """customer_ids that may contain q, or None when a scan is the faster way."""
+        if len(q) < 3:
+            return None
+        qcodes = np.unique(_gram_codes([q])[0])
+        slot = np.searchsorted(self._codes, qcodes)
+        found = slot < len(self._codes)
+        found[found] = self._codes[slot[found]] == qcodes[found]
+        size = np.where(found, self._bounds[np.minimum(slot + 1, len(self._codes))] - self._bounds[slot], 0)
+        if size.min() > SEARCH_SCAN_FRACTION * n_rows:
+            return None
+        out = None
+        for i in np.argsort(size, kind="stable"):
+            post = self._post[self._bounds[slot[i]]:self._bounds[slot[i] + 1]] if found[i] else np.zeros(0, np.int64)
+            extra = self._extra.get(int(qcodes[i]))
+            if extra:
+                post = np.union1d(post, np.fromiter(extra, dtype=np.int64))
+            out = post.astype(np.int64) if out is None else np.intersect1d(out, post, assume_unique=True)
+            if not len(out):
+                break
+        return out
 
+    def search(self, store: "DataStore", q: str, limit: Optional[int] = None,
+               rank: bool = True):
+        """
+        Return (customer_ids, total_matches) for rows whose lowercased name or
+        phone contains q (plain substring, as the old str.contains scan).
+        rank orders exact > prefix > word-start > other matches, earlier match
+        position first; without it results keep table order.
+        """
+        df = store.df
+        if not self.built:
+            self.build(df)
+        q = q.lower()
+        cand = self._candidates(q, len(df))
+        if cand is None:
+            rows = df[["customer_id", "name", "phone"]]
+        else:
+            labels = store.positions(cand).dropna()
+            rows = df.loc[labels.to_numpy(dtype=np.int64), ["customer_id", "name", "phone"]]
+        name = rows["name"].astype(object).fillna("").astype(str).str.lower()
+        phone = rows["phone"].astype(object).fillna("").astype(str)
+        hit = name.str.contains(q, regex=False) | phone.str.contains(q, regex=False)
+        rows, name, phone = rows[hit], name[hit], phone[hit]
+        if rank:
+            at_name = name.str.find(q).to_numpy()
+            pos = np.where(at_name >= 0, at_name, phone.str.find(q).to_numpy() + 1000).astype(int)
+            exact = (name == q) | (phone == q)
+            word = name.str.contains(" " + q, regex=False)
+            tier = np.select([exact, pos % 1000 == 0, word], [0, 1, 2], default=3)
+            order = np.lexsort((rows["customer_id"].to_numpy(), pos, tier))
+        else:
+            order = np.argsort(df.index.get_indexer(rows.index), kind="stable")
+        ids = rows["customer_id"].to_numpy()[order]
+        total = len(ids)
+        if limit is not None:
+            ids = ids[:limit]
+        return [int(c) for c in ids], total
+
+SEARCH_INDEX = SearchIndex()
+
+@instrumented()
+def find_customers(q: str, limit: Optional[int] = None, rank: bool = True):
+    """Headless customer search; see SearchIndex.search."""
+    store = get_store()
+    store.subscribe(SEARCH_INDEX)
+    return SEARCH_INDEX.search(store, q, limit=limit, rank=rank)
+
+@instrumented()
 def search_customer():
-    df = load_data()
+    store = get_store()
+    df = store.df
     if df.empty:
         cli_warn("No data.")
         return
@@ -495,65 +3232,237 @@ def search_customer():
     if not q:
         cli_warn("Empty query.")
         return
-    mask = df["name"].fillna("").str.lower().str.contains(q, na=False) | df["phone"].fillna("").str.contains(q, na=False)
-    hits = df[mask]
-    if hits.empty:
+    ids, total = find_customers(q, limit=SEARCH_RESULT_LIMIT)
+    if not ids:
         cli_info("No matches found.")
         return 
-    hits = hits.copy()
-    hits["bill_amount"] = hits.apply(lambda r: calculate_bill_row(r), axis=1)
+    hits = df.loc[[store.position(c) for c in ids]].copy()
+    hits["bill_amount"] = bill_amounts(hits)
     pretty_print_df(hits[["customer_id", "name", "phone", "consumption", "bill_amount"]])
+    if total > len(ids):
+        cli_info(f"Showing best {len(ids)} of {total} matches.")
+
+def read_input_csv(path: str) -> pd.DataFrame:
+    """An uploaded CSV as strings (timed as the read_input phase)."""
+    with METRICS.span("read_input"):
+        df_in = pd.read_csv(path, dtype=str)
+        if METRICS.active:
+            METRICS.note(rows=len(df_in), bytes_read=os.path.getsize(path))
+    return df_in
+
+def _parse_id_value(df_in: pd.DataFrame, value_col: str):
+    """
+    Validate a customer_id,<value_col> frame (read with dtype=str) in one pass.
+    Returns (customer_id, value, ok) where ok marks well-formed rows.
+    """
+    if "customer_id" not in df_in.columns or value_col not in df_in.columns:
+        empty = pd.Series(np.nan, index=df_in.index)
+        return empty, empty, pd.Series(False, index=df_in.index, dtype=bool)
+    cid_txt = df_in["customer_id"].astype("string").str.strip()
+    int_ok = cid_txt.str.fullmatch(r"[+-]?\d+").fillna(False).astype(bool)
+    cid = pd.to_numeric(cid_txt.where(int_ok), errors="coerce")
+    val_txt = df_in[value_col].astype("string").str.strip()
+    value = pd.to_numeric(val_txt, errors="coerce").astype(float)
+    ok = int_ok & value.notna()
+    return cid, value, ok
+
+def _parse_readings(df_in: pd.DataFrame):
+    return _parse_id_value(df_in, "current_reading")
+
+def apply_bulk_readings(store: "DataStore", df_in: pd.DataFrame,
+                        period: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Set-based meter-read update. Rows are validated together, aligned to the
+    customer frame through the store index, recorded in the reading history
+    for the period and the readings/consumption columns set in one step.
+    An ID repeated in the input keeps its last reading (a later read in the
+    same period is a correction).
+    Returns counts plus the rejected (malformed / unknown ID) input rows.
+    """
+    df_main = store.df
+    cid, reading, ok = _parse_readings(df_in)
+    labels = store.positions(cid[ok]) if ok.any() else pd.Series(dtype=float)
+    known = labels.notna()
+    upd = pd.DataFrame({
+        "customer_id": cid[ok][known].astype("int64"),
+        "label": labels[known].astype("int64"),
+        "reading": reading[ok][known],
+    })
+    final = upd[~upd["customer_id"].duplicated(keep="last")]
+    rows = final["label"].to_numpy()
+    new_read = final["reading"].to_numpy()
+    period = period or current_period()
+    # bills left unpaid from an earlier period move into arrears first
+    opening = ~READINGS.has_reading(final["customer_id"], period)
+    arrears, aged = roll_arrears(df_main.loc[rows], opening)
+    prev = READINGS.record(final["customer_id"].to_numpy(), new_read,
+                           df_main.loc[rows, "current_reading"].to_numpy(dtype=float), period)
+
+    cols = ["last_month_reading", "current_reading", "consumption", "paid", "paid_date",
+            "arrears", "overdue_periods"]
+    old = df_main.loc[rows, ["customer_id"] + cols].set_index("customer_id")
+    df_main.loc[rows, "arrears"] = arrears
+    df_main.loc[rows, "overdue_periods"] = aged
+    df_main.loc[rows, "last_month_reading"] = prev
+    df_main.loc[rows, "current_reading"] = new_read
+    df_main.loc[rows, "consumption"] = new_read - prev
+    df_main.loc[rows, "paid"] = False
+    df_main.loc[rows, "paid_date"] = ""
+    store.changed(old)
+    store.touch(final["customer_id"])
+
+    unknown_idx = labels.index[~known]
+    return {
+        "updated": len(final),     # customers changed
+        "rows": len(upd),          # input rows applied, repeated IDs included
+        "corrections": int((~opening).sum()),   # customers already read in the period
+        "unknown": len(unknown_idx),
+        "malformed": int((~ok).sum()),
+        "rejected": df_in.loc[(~ok) | df_in.index.isin(unknown_idx)],
+    }
 
-def bulk_update_consumption_from_csv(path: str):
+@instrumented()
+def bulk_update_consumption_from_csv(path: str, period: Optional[str] = None):
     """
     Import a CSV with columns: customer_id,current_reading
-    For each row, update current_reading and recalc consumption.
+    Updates current_reading and recalcs consumption for all rows at once
+    (see apply_bulk_readings). Returns its result, or None if the file
+    could not be read or applied.
     """
     try:
-        df_main = load_data()
-        df_in = pd.read_csv(path, dtype=str)
-        updates = 0
-        for _, r in df_in.iterrows():
-            try:
-                cid = int(r.get("customer_id", "").strip())
-                new_read = float(r.get("current_reading", "").strip())
-            except Exception:
-                continue
-            if cid in df_main["customer_id"].values:
-                idx = df_main.index[df_main["customer_id"] == cid][0]
-                prev = float(df_main.at[idx, "current_reading"])
-                df_main.at[idx, "last_month_reading"] = prev
-                df_main.at[idx, "current_reading"] = new_read
-                df_main.at[idx, "consumption"] = new_read - prev
-                df_main.at[idx, "paid"] = False
-                updates += 1
-        save_data(df_main)
-        append_audit("bulk_update_consumption", f"path={path}, updates={updates}")
-        cli_info(f"Bulk update complete: {updates} records updated.")
+        store = get_store()
+        df_in = read_input_csv(path)
+        period = period or current_period()
+        res = apply_bulk_readings(store, df_in, period)
+        updates = res["updated"]
+        append_audit("bulk_update_consumption",
+                     f"path={path}, period={period}, updates={updates}, rows={res['rows']}, "
+                     f"corrections={res['corrections']}, unknown={res['unknown']}, malformed={res['malformed']}")
+        cli_info(f"Bulk update complete: {updates} customers updated for {period} from {res['rows']} readings.")
+        if res["corrections"]:
+            cli_info(f"{res['corrections']} of them already had a {period} reading: replaced as corrections "
+                     f"(consumption from the {_prev_period(period)} reading, arrears not rolled).")
+        if res["unknown"] or res["malformed"]:
+            cli_warn(f"Skipped {res['unknown']} rows with unknown IDs and {res['malformed']} malformed rows.")
+        return res
     except FileNotFoundError:
         cli_error("Import file not found.")
     except Exception as e:
         cli_error(f"Bulk import failed: {e}")
+    return None
+
+# -------------------------
+# Payment ingest
+# -------------------------
+# A payments file has customer_id,amount,reference rows. Payments are summed
+# per customer and compared with what the account owes (arrears + current
+# bill, 0 when already paid):
+#   exact (to the cent)  -> marked paid
+#   overpayment          -> marked paid, excess listed as an exception
+#   partial payment      -> left unpaid, shortfall listed as an exception
+#   nothing owed         -> "already_paid" exception (duplicate or misapplied payment)
+#   unknown ID, malformed row, repeated reference -> exception only
+
+def reconcile_payments(store: "DataStore", df_in: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Reconcile a payments frame (read with dtype=str) against the store and
+    mark settled accounts paid in one update_where. Returns counts and the
+    exception rows (input columns plus reason, due, difference).
+    """
+    df = store.df
+    cid, amount, ok = _parse_id_value(df_in, "amount")
+    ref = df_in["reference"].astype("string").str.strip() if "reference" in df_in.columns else \
+        pd.Series(pd.NA, index=df_in.index, dtype="string")
+    reason = pd.Series("", index=df_in.index, dtype=object)
+    reason[~ok] = "malformed"
+    dup_ref = ref.notna() & (ref != "") & ref.duplicated(keep="first")
+    reason[ok & dup_ref.to_numpy()] = "duplicate_reference"
+    valid = ok & ~dup_ref.to_numpy()
+    labels = store.positions(cid[valid]) if valid.any() else pd.Series(dtype=float)
+    reason[labels.index[labels.isna()]] = "unknown_id"
+
+    pay = pd.DataFrame({"customer_id": cid[labels.index[labels.notna()]].astype("int64"),
+                        "amount": amount[labels.index[labels.notna()]]})
+    per_cust = pay.groupby("customer_id", sort=False)["amount"].sum()
+    rows = df.loc[store.positions(per_cust.index).astype("int64").to_numpy()]
+    unpaid = ~rows["paid"].to_numpy(dtype=bool)
+    due = np.where(unpaid, rows["arrears"].to_numpy(dtype=float) + bill_amounts(rows).to_numpy(), 0.0)
+    due = _round_cents(due)
+    diff = _round_cents(per_cust.to_numpy() - due)
+    cust_reason = np.select([due < 0.005, np.abs(diff) < 0.005, diff > 0],
+                            ["already_paid", "", "overpayment"], default="partial")
+    settled = per_cust.index[np.isin(cust_reason, ["", "overpayment"])]
+
+    # map per-customer outcomes back onto the payment rows
+    outcome = pd.DataFrame({"reason": cust_reason, "due": due, "difference": diff}, index=per_cust.index)
+    paid_rows = pay.join(outcome, on="customer_id")
+    reason[paid_rows.index] = paid_rows["reason"]
+    exceptions = df_in.loc[reason != ""].copy()
+    exceptions["reason"] = reason[reason != ""]
+    exceptions["due"] = paid_rows["due"].reindex(exceptions.index)
+    exceptions["difference"] = paid_rows["difference"].reindex(exceptions.index)
+
+    if len(settled):
+        store.update_where(df["customer_id"].isin(settled),
+                           {"paid": True, "paid_date": "",
+                            "arrears": 0.0, "overdue_periods": 0})
+    counts = exceptions["reason"].value_counts()
+    return {
+        "payments": len(df_in),
+        "settled": len(settled),
+        "overpaid": int(counts.get("overpayment", 0)),
+        "partial": int(counts.get("partial", 0)),
+        "unknown": int(counts.get("unknown_id", 0)),
+        "malformed": int(counts.get("malformed", 0)),
+        "duplicates": int(counts.get("duplicate_reference", 0)),
+        "already_paid": int(counts.get("already_paid", 0)),
+        "exceptions": exceptions,
+    }
+
+@instrumented()
+def ingest_payments_file(path: str, exceptions_path: str = PAYMENT_EXCEPTIONS_FILE) -> Optional[Dict[str, Any]]:
+    """Reconcile a payment-gateway CSV; exceptions go to exceptions_path."""
+    try:
+        df_in = read_input_csv(path)
+    except FileNotFoundError:
+        cli_error("Payments file not found.")
+        return None
+    res = reconcile_payments(get_store(), df_in)
+    exc = res["exceptions"]
+    if len(exc):
+        exc.to_csv(exceptions_path, index=False)
+    elif os.path.exists(exceptions_path):
+        os.remove(exceptions_path)   # a stale list from an earlier run would read as this run's
+    append_audit("ingest_payments",
+                 f"path={path}, payments={res['payments']}, settled={res['settled']}, "
+                 f"overpaid={res['overpaid']}, partial={res['partial']}, unknown={res['unknown']}, "
+                 f"malformed={res['malformed']}, duplicates={res['duplicates']}, already_paid={res['already_paid']}")
+    cli_info(f"Payments: {res['settled']} accounts settled from {res['payments']} payments.")
+    if len(exc):
+        cli_warn(f"{len(exc)} payments need review; written to {exceptions_path}")
+    return res
 
 # =====================================================
 # PART 4: CLIENT INTERFACE & MAIN MENU
 # Darshan
 # =====================================================
 
+@instrumented()
 def client_register():
     add_customer()
 
+@instrumented()
 def client_view():
-    df = load_data()
-    if df.empty:
+    store = get_store()
+    if store.df.empty:
         cli_warn("No data.")
         return
     cid = read_int("Enter your Customer ID: ")
-    if cid not in df["customer_id"].values:
+    if cid not in store:
         cli_error("Customer ID not found.")
         return
-    rec = df[df["customer_id"] == cid].iloc[0].to_dict()
-    bill = calculate_bill_row(rec)
+    rec = store.get(cid)
+    bill = float(bill_amounts(store.df.loc[[store.position(cid)]]).iloc[0])
     print("\n--- CLIENT RECORD ---")
     print(f"ID: {rec['customer_id']}")
     print(f"Name: {rec['name']}")
@@ -564,52 +3473,91 @@ def client_view():
     print(f"Bill amount: {bill:.2f}")
     print(f"Paid: {rec.get('paid', False)}  Paid date: {rec.get('paid_date','')}")
 
-def import_customers_from_csv(path: str):
+IMPORT_CHUNK_ROWS = 100_000  # customer rows parsed per batch when importing
+
+def new_customer_frame(start_id: int, names, addresses, phones, last_reads, tariffs,
+                       last_updated="") -> pd.DataFrame:
+    """Build COLUMNS-shaped rows for new customers with IDs start_id, start_id+1, ..."""
+    n = len(names)
+    last_reads = np.asarray(last_reads, dtype=float)
+    return pd.DataFrame({
+        "customer_id": np.arange(start_id, start_id + n, dtype="int64"),
+        "name": list(names),
+        "address": list(addresses),
+        "phone": list(phones),
+        "last_month_reading": last_reads,
+        "current_reading": last_reads.copy(),
+        "consumption": np.zeros(n),
+        "tariff_per_unit": np.asarray(tariffs, dtype=float),
+        "last_updated": last_updated,
+        "paid": False,
+        "paid_date": "",
+        "plan_id": "",
+        "arrears": 0.0,
+        "overdue_periods": 0,
+        "row_version": 0,
+    }, columns=COLUMNS)
+
+def _import_chunk(rows: List[Dict[str, Any]], fields, start_id: int) -> pd.DataFrame:
+    """Parse one batch of csv.DictReader rows (name,address,phone,last_reading,tariff)."""
+    n = len(rows)
+    if "name" in fields:
+        names = [r.get("name") for r in rows]
+    else:
+        names = [f"Customer{cid}" for cid in range(start_id, start_id + n)]
+    addresses = [r.get("address", "") for r in rows]
+    phones = [r.get("phone", "") for r in rows]
+    # same fallbacks as before: blank/invalid reading -> 0, blank/invalid tariff -> 1.0
+    last_reads = pd.to_numeric(pd.Series([r.get("last_reading") for r in rows], dtype=object),
+                               errors="coerce").fillna(0.0)
+    tariffs = pd.to_numeric(pd.Series([r.get("tariff") for r in rows], dtype=object),
+                            errors="coerce").fillna(1.0)
+    return new_customer_frame(start_id, names, addresses, phones, last_reads, tariffs)
+
+def import_customer_rows(store: "DataStore", rows, fields, chunk_rows: int = IMPORT_CHUNK_ROWS) -> int:
+    """
+    Add customers from an iterable of dict rows. Rows are consumed chunk_rows
+    at a time into compact column frames, so only one chunk of Python dicts
+    is alive at once; IDs are a contiguous range from store.next_id() and the
+    store frame is concatenated once at the end. Returns the number added.
+    """
+    next_id = store.next_id()
+    frames = []
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, chunk_rows))
+        if not batch:
+            break
+        frames.append(_import_chunk(batch, fields, next_id))
+        next_id += len(batch)
+    if not frames:
+        return 0
+    new = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    store.add(new)
+    return len(new)
+
+@instrumented()
+def import_customers_from_csv(path: str, chunk_rows: int = IMPORT_CHUNK_ROWS):
     """
     Import CSV with header columns: name,address,phone,last_reading,tariff
-    Uses csv.DictReader for robust parsing.
+    Uses csv.DictReader for robust parsing, streamed in chunks of chunk_rows.
+    Returns the number of customers added, or None if the import failed.
     """
     try:
         with open(path, newline='', encoding='utf-8') as f:
             reader = csv.DictReader(f)
-            df_main = load_data()
-            next_id = next_customer_id(df_main)
-            added = 0
-            for row in reader:
-                name = row.get("name", f"Customer{next_id}")
-                address = row.get("address", "")
-                phone = row.get("phone", "")
-                try:
-                    last_read = float(row.get("last_reading", 0) or 0)
-                except Exception:
-                    last_read = 0.0
-                try:
-                    tariff = float(row.get("tariff", 1.0) or 1.0)
-                except Exception:
-                    tariff = 1.0
-                new = {
-                    "customer_id": next_id,
-                    "name": name,
-                    "address": address,
-                    "phone": phone,
-                    "last_month_reading": last_read,
-                    "current_reading": last_read,
-                    "consumption": 0.0,
-                    "tariff_per_unit": tariff,
-                    "last_updated": "",
-                    "paid": False,
-                    "paid_date": ""
-                }
-                df_main = pd.concat([df_main, pd.DataFrame([new])], ignore_index=True)
-                next_id += 1
-                added += 1
-            save_data(df_main)
+            store = get_store()
+            added = import_customer_rows(store, reader, reader.fieldnames or [], chunk_rows)
+            if METRICS.active:
+                METRICS.note(rows=added, bytes_read=os.path.getsize(path))
             append_audit("import_customers", f"path={path}, added={added}")
             cli_info(f"Imported {added} customers from {path}")
+            return added
     except FileNotFoundError:
         cli_error("Import file not found.")
     except Exception as e:
         cli_error(f"Import failed: {e}")
+    return None
 
 def show_help():
     print("""
@@ -617,16 +3565,17 @@ def show_help():
 Commands are available via menus. Key operations:
  - Admin:
     * Add Customer
-    * Update Consumption
+    * Update Consumption (asks for the billing period, default this month;
+      a second reading in the same period replaces the first as a correction)
     * Delete Customer
-    * View All Customers (paginated)
+    * View All Customers (paginated; sort, filter, jump to page or ID)
     * Summary Report (with optional export)
     * Export Bills
     * Update Tariff (single/bulk/global)
     * Mark Paid
     * List Overdue
     * Search Customer
-    * Backup Data
+    * Backup Data / Restore a backup generation
     * Import customers from CSV
  - Client:
     * Register (calls Add Customer)
@@ -634,7 +3583,18 @@ Commands are available via menus. Key operations:
  - General:
     * Demo mode: creates sample data
     * Use CSV import/export for batch operations
-Note: This implementation uses only pandas, numpy, and csv.
+    * Storage format: WATER_STORAGE_FORMAT=csv|npz|parquet|feather
+      (convert with: python water_portal.py migrate csv npz)
+    * Sharded storage: python water_portal.py shard 4 (1 = back to one file)
+    * Batch jobs: python water_portal.py --help (import-customers,
+      bulk-readings, export-bills, summary, backup, mark-paid, payments,
+      set-tariff),
+      or a job file of such lines: python water_portal.py run nightly.job
+    * Read-only HTTP API: python water_portal.py serve --port 8080
+    * Timings: python water_portal.py --metrics ... (metrics.json, GET /stats);
+      profile one operation: --profile export_bills (or WATER_PROFILE=...)
+Note: Needs only pandas and numpy besides the Python standard library;
+      pyarrow is optional (parquet/feather storage, Arrow-backed strings).
 """)
 
 def admin_menu():
@@ -654,6 +3614,11 @@ def admin_menu():
         print("12. Import customers from CSV")
         print("13. Bulk update consumption from CSV")
         print("14. Export customers to custom CSV path")
+        print("15. Memory usage report")
+        print("16. Restore backup generation")
+        print("17. Consumption by area")
+        print("18. Reading history for a customer")
+        print("19. Ingest payments file")
         print("0. Logout")
         ch = input("Choice: ").strip()
         if ch == "1":
@@ -666,7 +3631,8 @@ def admin_menu():
             view_all_customers()
         elif ch == "5":
             det = input("Export detailed summary? (y/n): ").strip().lower()
-            summary_report(detailed=(det == "y"))
+            ex = input("Exact statistics (full rescan)? (y/n): ").strip().lower()
+            summary_report(detailed=(det == "y"), exact=(ex == "y"))
         elif ch == "6":
             export_bills()
         elif ch == "7":
@@ -684,11 +3650,23 @@ def admin_menu():
             import_customers_from_csv(path)
         elif ch == "13":
             path = input("Enter CSV path for bulk consumption updates (cols: customer_id,current_reading): ").strip()
-            bulk_update_consumption_from_csv(path)
+            bulk_update_consumption_from_csv(path, read_period())
         elif ch == "14":
             path = input("Enter target CSV path for exporting customers: ").strip()
             export_customers_csv(path)
+        elif ch == "15":
+            memory_report()
+        elif ch == "16":
+            restore_backup_interactive()
+        elif ch == "17":
+            area_report()
+        elif ch == "18":
+            reading_history()
+        elif ch == "19":
+            path = input("Payments CSV path (customer_id,amount,reference): ").strip()
+            ingest_payments_file(path)
         elif ch == "0":
+            flush_all()
             break
         else:
             cli_error("Invalid option. Enter the menu number.")
@@ -712,6 +3690,7 @@ def client_menu():
         else:
             cli_error("Invalid option.")
 
+@instrumented()
 def create_demo_data():
     sample = [
         ("Ravi Kumar", "Vellore", "9000000001", 420, 2.5),
@@ -722,27 +3701,10 @@ def create_demo_data():
         ("Priya Sharma", "Chennai", "9000000006", 315, 2.5),
         ("Vikram Rao", "Vellore", "9000000007", 485, 2.0)
     ]
-    df = load_data()
-    next_id = next_customer_id(df)
-    added = 0
-    for name, addr, phone, last_read, tariff in sample:
-        new = {
-            "customer_id": next_id,
-            "name": name,
-            "address": addr,
-            "phone": phone,
-            "last_month_reading": float(last_read),
-            "current_reading": float(last_read),
-            "consumption": 0.0,
-            "tariff_per_unit": float(tariff),
-            "last_updated": "",
-            "paid": False,
-            "paid_date": ""
-        }
-        df = pd.concat([df, pd.DataFrame([new])], ignore_index=True)
-        next_id += 1
-        added += 1
-    save_data(df)
+    store = get_store()
+    names, addrs, phones, reads, tariffs = zip(*sample)
+    store.add(new_customer_frame(store.next_id(), names, addrs, phones, reads, tariffs))
+    added = len(sample)
     append_audit("demo_data", f"Added {added} demo rows")
     cli_info(f"Demo: Added {added} sample customers.")
 
@@ -770,18 +3732,432 @@ def main_menu():
         elif ch == "4":
             show_help()
         elif ch == "0":
+            flush_all()
             cli_info("Goodbye.")
             break
         else:
             cli_error("Invalid choice. Enter a menu number.")
 
+# -------------------------
+# HTTP read API
+# -------------------------
+# python water_portal.py serve [--host H] [--port P]
+#   GET /customers/<id>        customer record
+#   GET /customers/<id>/bill   bill breakdown
+#   GET /search?q=..&limit=N   name/phone search (see SearchIndex)
+#   GET /stats                 rolling request/reload timings (with --metrics)
+# Read-only: serves the saved data file (edits still in another session's
+# journal show up once that session saves) and reloads it when it changes.
+SERVE_RELOAD_SECONDS = 1.0   # how often the data/plans files are checked for changes
+SERVE_SEARCH_LIMIT = 25       # default /search page size
+SERVE_SEARCH_MAX_LIMIT = 500  # larger limits are clamped to this
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; a waiting writer blocks new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+def _py(value):
+    """JSON-safe Python value for a NumPy/pandas scalar."""
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+class ReadAPI:
+    """
+    In-memory snapshot served over HTTP: the customer frame as plain column
+    arrays, a bill column computed in one vectorized pass, the customer_id
+    index and a prebuilt SearchIndex. A reload builds a new snapshot off to
+    the side and swaps it in under the write lock.
+    """
+
+    def __init__(self):
+        self.lock = ReadWriteLock()
+        self._reload_lock = threading.Lock()
+        self._stamp = None
+        self.reload()
+
+    @staticmethod
+    def _file_stamp():
+        stamps = []
+        for path in (SHARDS.manifest_path if SHARDS.exists() else data_path(), PLANS_FILE):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    @instrumented("api.reload")
+    def reload(self, force: bool = True) -> bool:
+        """Rebuild the snapshot if the files changed (always when force)."""
+        global _PLANS
+        with self._reload_lock:
+            stamp = self._file_stamp()
+            if not force and stamp == self._stamp:
+                return False
+            _PLANS = None   # pick up tariff plan edits too
+            store = DataStore(policy=FLUSH_ON_EXIT, journal=False)
+            df = store.df
+            bills = bill_amounts(df).to_numpy()
+            index = SearchIndex()
+            index.build(df)
+            snap = {
+                "store": store,
+                "cols": {col: df[col].to_numpy() for col in df.columns if col not in INTERNAL_COLUMNS},
+                "bill": bills,
+                "row": {cid: i for i, cid in enumerate(df["customer_id"].tolist())},
+                "search": index,
+                "plans": get_plans(),
+            }
+            self.lock.acquire_write()
+            try:
+                self.snap = snap
+                self._stamp = stamp
+            finally:
+                self.lock.release_write()
+            return True
+
+    def watch(self, stop: threading.Event, every: float = SERVE_RELOAD_SECONDS) -> None:
+        while not stop.wait(every):
+            try:
+                if self.reload(force=False):
+                    cli_info("Data changed on disk; reloaded.")
+            except Exception as e:
+                cli_warn(f"Reload failed, still serving the previous data: {e}")
+
+    # request handlers; each runs under the read lock and returns (status, body)
+    @instrumented("api.customer")
+    def customer(self, snap, cid: int):
+        i = snap["row"].get(cid)
+        if i is None:
+            return 404, {"error": "customer not found"}
+        return 200, {col: _py(arr[i]) for col, arr in snap["cols"].items()}
+
+    @instrumented("api.bill")
+    def bill(self, snap, cid: int):
+        i = snap["row"].get(cid)
+        if i is None:
+            return 404, {"error": "customer not found"}
+        cols = snap["cols"]
+        plan = _py(cols["plan_id"][i]) or snap["plans"].default_plan
+        bill = float(snap["bill"][i])
+        return 200, {
+            "customer_id": cid,
+            "consumption": _py(cols["consumption"][i]),
+            "tariff_per_unit": _py(cols["tariff_per_unit"][i]),
+            "plan_id": plan,
+            "bill_amount": bill,
+            "arrears": _py(cols["arrears"][i]),
+            "outstanding": round(bill + float(cols["arrears"][i]), 2),
+            "paid": bool(cols["paid"][i]),
+        }
+
+    @instrumented("api.search")
+    def search(self, snap, q: str, limit: int):
+        if not q:
+            return 400, {"error": "missing q"}
+        ids, total = snap["search"].search(snap["store"], q, limit=limit)
+        cols = snap["cols"]
+        rows = [snap["row"][c] for c in ids]
+        return 200, {"total": total, "results": [
+            {"customer_id": c, "name": _py(cols["name"][i]), "phone": _py(cols["phone"][i])}
+            for c, i in zip(ids, rows)]}
+
+    def handle(self, path: str):
+        url = urlparse(path)
+        parts = [p for p in url.path.split("/") if p]
+        self.lock.acquire_read()
+        try:
+            snap = self.snap
+            if parts == ["stats"]:
+                return 200, METRICS.snapshot()
+            if parts == ["search"]:
+                qs = parse_qs(url.query)
+                try:
+                    limit = int(qs.get("limit", [SERVE_SEARCH_LIMIT])[0])
+                except ValueError:
+                    return 400, {"error": "bad limit"}
+                if limit < 1:
+                    return 400, {"error": "limit must be at least 1"}
+                return self.search(snap, qs.get("q", [""])[0].strip(), min(limit, SERVE_SEARCH_MAX_LIMIT))
+            if len(parts) in (2, 3) and parts[0] == "customers":
+                try:
+                    cid = int(parts[1])
+                except ValueError:
+                    return 400, {"error": "customer id must be an integer"}
+                if len(parts) == 2:
+                    return self.customer(snap, cid)
+                if parts[2] == "bill":
+                    return self.bill(snap, cid)
+            return 404, {"error": "not found"}
+        finally:
+            self.lock.release_read()
+
+class _APIHandler(BaseHTTPRequestHandler):
+    api: ReadAPI = None  # set by serve()
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True   # headers and body go out as separate writes
+
+    def do_GET(self):
+        status, body = self.api.handle(self.path)
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass   # one line per request would dominate the cost of a lookup
+
+def serve(host: str = "127.0.0.1", port: int = 8080) -> None:
+    """Run the read API until interrupted."""
+    init_storage()
+    flush_all()
+    api = ReadAPI()
+    handler = type("APIHandler", (_APIHandler,), {"api": api})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    stop = threading.Event()
+    threading.Thread(target=api.watch, args=(stop,), daemon=True).start()
+    cli_info(f"Serving {len(api.snap['row'])} customers on http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+# -------------------------
+# Batch jobs
+# -------------------------
+# python water_portal.py <command> [options]   one step
+# python water_portal.py run nightly.job       one step per line ('#' comments)
+# Every step of an invocation works on one loaded dataset in memory; the
+# data file is saved once at the end (also when a step fails, so the
+# reading history and the data file stay in step).
+
+def _read_ids(path: str) -> List[int]:
+    """Customer IDs from a file: one per line, or a CSV whose first column is customer_id."""
+    col = pd.read_csv(path, dtype=str, header=None, usecols=[0], skip_blank_lines=True)[0].str.strip()
+    if len(col) and not col.iloc[0].isdigit():
+        col = col.iloc[1:]   # header line
+    return pd.to_numeric(col, errors="raise").astype(int).tolist()
+
+def _ids_from(args) -> Optional[List[int]]:
+    if args.ids_file:
+        return _read_ids(args.ids_file)
+    if args.ids:
+        return [int(c) for c in args.ids.split(",") if c.strip()]
+    return None
+
+def mark_paid_ids(ids: List[int]) -> int:
+    """Mark many customers paid in one store update; returns how many matched."""
+    store = get_store()
+    mask = store.df["customer_id"].isin(ids)
+    matched = store.update_where(mask, {"paid": True, "paid_date": "", "arrears": 0.0, "overdue_periods": 0})
+    append_audit("mark_paid_bulk", f"matched={matched}, unknown={len(set(ids)) - matched}")
+    cli_info(f"Marked {matched} customers as PAID.")
+    if len(set(ids)) > matched:
+        cli_warn(f"{len(set(ids)) - matched} IDs not found.")
+    return matched
+
+def _succeeded(result, what: str):
+    """The menu helpers report their own errors and return None/False; a batch step must fail."""
+    if result is None or result is False:
+        raise RuntimeError(f"{what} failed")
+    return result
+
+def _cmd_import(args):
+    _succeeded(import_customers_from_csv(args.path), "import")
+
+def _cmd_readings(args):
+    _succeeded(bulk_update_consumption_from_csv(args.path, args.period), "bulk readings")
+
+def _cmd_export(args):
+    export_bills(args.out, shards=args.shards, workers=args.workers)
+
+def _cmd_summary(args):
+    summary_report(detailed=args.detailed, exact=args.exact)
+
+def _cmd_backup(args):
+    _succeeded(backup_data(), "backup")
+
+def _cmd_mark_paid(args):
+    ids = _ids_from(args)
+    if ids is None:
+        raise ValueError("mark-paid needs --ids-file or --ids")
+    mark_paid_ids(ids)
+
+def _cmd_set_tariff(args):
+    store = get_store()
+    df = store.df
+    if (args.tariff is None) == (args.plan is None):
+        raise ValueError("set-tariff needs exactly one of --tariff or --plan")
+    ids = _ids_from(args)
+    mask = df["customer_id"].isin(ids) if ids is not None else pd.Series(True, index=df.index)
+    if args.above is not None:
+        mask &= df["consumption"].astype(float) > args.above
+    if args.plan is not None:
+        if args.plan and args.plan not in get_plans().plans:
+            raise ValueError(f"Unknown plan: {args.plan}")
+        values = {"plan_id": args.plan}
+    else:
+        values = {"tariff_per_unit": float(args.tariff)}
+    matched = store.update_where(mask, values)
+    append_audit("set_tariff_batch", f"{values}, matched={matched}")
+    cli_info(f"Updated {matched} customers.")
+
+def _cmd_payments(args):
+    _succeeded(ingest_payments_file(args.path, args.exceptions), "payment ingest")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="water_portal.py",
+                                     description="Water utility portal. Without a command, opens the menu.")
+    parser.add_argument("--metrics", action="store_true",
+                        help=f"record per-operation timings to {METRICS_FILE} (or --metrics-file)")
+    parser.add_argument("--metrics-file", metavar="FILE")
+    parser.add_argument("--profile", metavar="OPERATION",
+                        help="cProfile every run of OPERATION (e.g. export_bills, '*' = each top-level one)")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("demo", help="add sample customers, then open the menu")
+    p = sub.add_parser("migrate", help="convert the data file between storage formats")
+    p.add_argument("src", choices=list(STORAGE_BACKENDS))
+    p.add_argument("dst", choices=list(STORAGE_BACKENDS))
+    p = sub.add_parser("shard", help="split the data into N customer_id-range files (1 = merge back)")
+    p.add_argument("n", type=int)
+    p = sub.add_parser("serve", help="HTTP read API (customers, bills, search)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p = sub.add_parser("run", help="run a job file, one command per line")
+    p.add_argument("jobfile")
+
+    p = sub.add_parser("import-customers", help="CSV with name,address,phone,last_reading,tariff")
+    p.add_argument("path")
+    p.set_defaults(func=_cmd_import)
+    p = sub.add_parser("bulk-readings", help="CSV with customer_id,current_reading")
+    p.add_argument("path")
+    p.add_argument("--period", help="billing period YYYY-MM (default: this month)")
+    p.set_defaults(func=_cmd_readings)
+    p = sub.add_parser("export-bills", help="write the bills CSV")
+    p.add_argument("--out", default=BILLS_FILE)
+    p.add_argument("--shards", type=int)
+    p.add_argument("--workers", type=int)
+    p.set_defaults(func=_cmd_export)
+    p = sub.add_parser("summary", help="print consumption statistics")
+    p.add_argument("--exact", action="store_true")
+    p.add_argument("--detailed", action="store_true", help=f"also write {SUMMARY_FILE}")
+    p.set_defaults(func=_cmd_summary)
+    p = sub.add_parser("backup", help="create the next backup generation")
+    p.set_defaults(func=_cmd_backup)
+    p = sub.add_parser("mark-paid", help="mark customers paid")
+    p.add_argument("--ids-file")
+    p.add_argument("--ids", help="comma-separated customer IDs")
+    p.set_defaults(func=_cmd_mark_paid)
+    p = sub.add_parser("payments", help="reconcile a payments CSV (customer_id,amount,reference)")
+    p.add_argument("path")
+    p.add_argument("--exceptions", default=PAYMENT_EXCEPTIONS_FILE)
+    p.set_defaults(func=_cmd_payments)
+    p = sub.add_parser("set-tariff", help="set tariff_per_unit or plan_id (all customers unless filtered)")
+    p.add_argument("--tariff", type=float)
+    p.add_argument("--plan", help="plan ID ('' = default plan)")
+    p.add_argument("--ids-file")
+    p.add_argument("--ids", help="comma-separated customer IDs")
+    p.add_argument("--above", type=float, help="only customers with consumption above this")
+    p.set_defaults(func=_cmd_set_tariff)
+    return parser
+
+def _job_steps(path: str) -> List[List[str]]:
+    steps = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            argv = shlex.split(line, comments=True)
+            if argv:
+                steps.append(argv)
+    return steps
+
+def run_batch(steps: List[List[str]]) -> int:
+    """
+    Run parsed command lines against one in-memory dataset and save once.
+    Stops at the first failing step; returns a process exit code.
+    """
+    global _STORE
+    parser = build_parser()
+    parsed = []
+    for argv in steps:
+        args = parser.parse_args(argv)
+        if getattr(args, "func", None) is None:
+            parser.error(f"'{argv[0]}' cannot be used in a job")
+        parsed.append(args)
+    init_storage()
+    flush_all()   # anything recovered from the journal is saved before the batch starts
+    _STORE = DataStore(policy=FLUSH_ON_EXIT, journal=False)
+    status = 0
+    for argv, args in zip(steps, parsed):
+        try:
+            with METRICS.span(f"batch.{args.command}"):
+                args.func(args)
+        except Exception as e:
+            cli_error(f"Step '{' '.join(argv)}' failed: {e}")
+            status = 1
+            break
+    append_audit("batch", f"steps={len(steps)}, status={status}")
+    flush_all()
+    return status
+
 # CLI arg support
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1].lower() in ("demo", "--demo"):
+    argv = sys.argv[1:]
+    if argv and argv[0].lower() in ("--demo", "demo"):
+        argv[0] = "demo"
+    args = build_parser().parse_args(argv)
+    METRICS.configure(enabled=args.metrics or bool(args.metrics_file) or None,
+                      path=args.metrics_file, profile=args.profile)
+    if args.command is None:
+        main_menu()
+    elif args.command == "demo":
         init_storage()
         create_demo_data()
         main_menu()
+    elif args.command == "migrate":
+        migrate_storage(args.src, args.dst)
+    elif args.command == "shard":
+        init_storage()
+        shard_storage(args.n)
+    elif args.command == "serve":
+        serve(args.host, args.port)
+    elif args.command == "run":
+        sys.exit(run_batch(_job_steps(args.jobfile)))
     else:
-        main_menu()
-
-
+        sys.exit(run_batch([argv]))